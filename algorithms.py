@@ -3,10 +3,10 @@
 # Created by 'myth' on 10/2/15
 
 from abc import abstractmethod
-from itertools import product
+from collections import deque
 from common import *
+from datastructures import PriorityAgenda, BucketAgenda, FifoAgenda, LifoAgenda, SearchStep, UnionView, FrontierView
 import abc
-import heapq
 
 
 # --- A* ---
@@ -14,12 +14,28 @@ import heapq
 ASTAR_OPTIONS = [
     'best',
     'dfs',
-    'bfs'
+    'bfs',
+    'jps',
+    'bidirectional',
+    'ida',
+    'ara',
+    'hpa',
+    'dstar'
 ]
 ASTAR_HEURISTIC = [
     'manhattan',
-    'euclidean'
+    'euclidean',
+    'landmarks',
+    'exact'
 ]
+ASTAR_AGENDAS = {
+    'best': PriorityAgenda,  # Ascending heap queue on F and H
+    'bfs': FifoAgenda,  # Insert to back, take from front (FIFO)
+    'dfs': LifoAgenda,  # Insert to back, take from back (LIFO)
+    'jps': PriorityAgenda,  # Best-first over jump points
+    'ara': PriorityAgenda,  # Anytime repairing best-first, with a decreasing weight
+    'hpa': PriorityAgenda  # Best-first over the abstract graph of a hierarchical problem
+}
 
 
 class AStarProblem(metaclass=abc.ABCMeta):
@@ -47,15 +63,53 @@ class AStarProblem(metaclass=abc.ABCMeta):
     def heuristic(self, node):
         pass
 
+    def has_integer_costs(self):
+        """
+        Returns whether every arc cost and heuristic value of the problem is an integer. Problems that promise this
+        are searched with the bucket agenda instead of the heap
+        """
+        return False
+
+
+def create_agenda(mode, problem, tie_break='fifo', weight=1):
+    """
+    Creates the open set of an A* mode. The heap of the best-first modes is replaced by a bucket queue when the
+    problem has integer arc costs and heuristic values, and the weight keeps every F value an integer.
+    The ara mode lowers its weight between searches, and keeps the heap
+    :param mode: The A* mode
+    :param problem: The problem that will be searched
+    :param tie_break: 'fifo' or 'lifo', see the PriorityAgenda
+    :param weight: The weight on the heuristic
+    :return: An empty agenda
+    """
+    agenda = ASTAR_AGENDAS[mode]
+    if agenda is PriorityAgenda and mode != 'ara' and float(weight).is_integer() and problem.has_integer_costs():
+        agenda = BucketAgenda
+
+    debug('Using %s for the %s mode' % (agenda.__name__, mode))
+    return agenda(tie_break=tie_break)
+
 
 class AStar(object):
     """
     A general A* algorithm class. Takes the mode and a problem instance as parameters
     :param mode: The mode to run the A* algorithm in
     :param problem: The problem to run A* on
+    :param snapshot_interval: Only yield a step every N expansions. The goal step and the last step are always yielded
+    :param propagation_budget: Maximum number of nodes to process when propagating an improved path through
+    closed nodes. Nodes left over are reopened instead. None means no limit
+    :param tie_break: 'fifo' or 'lifo', which of the nodes with equal F and H values the best-first agenda takes first
+    :param low_memory: Skip the child bookkeeping and keep parents on the nodes instead of in the parent_of dict.
+    Improved paths to closed nodes are then not propagated, which is only safe with a consistent heuristic.
+    The problem state of an expanded node is also released when the search moves on to the next node,
+    so consumers of the step stream must read it before resuming the loop
+    :param weight: Weight on the heuristic, F = G + weight * H. Values above 1 find a solution faster, costing at most
+    weight times the optimal cost with an admissible heuristic. In ara mode this is the initial weight
+    :param weight_step: How much the weight is lowered between the searches of the ara mode
     """
 
-    def __init__(self, mode='best', problem=None):
+    def __init__(self, mode='best', problem=None, snapshot_interval=1, propagation_budget=None, tie_break='fifo',
+                 low_memory=False, weight=1.0, weight_step=0.5):
         """
         Initializing the A* object with the given parameters
         """
@@ -66,8 +120,37 @@ class AStar(object):
 
         self.mode = mode
         self.problem = problem
+        self.snapshot_interval = max(1, snapshot_interval)
+        self.propagation_budget = propagation_budget
+        self.low_memory = low_memory
 
-        self.open_set = []
+        if self.mode not in ASTAR_AGENDAS:
+            raise Exception("Unknown A* mode: %s" % self.mode)
+
+        if self.mode == 'jps' and not hasattr(self.problem, 'get_jump_point_successors'):
+            raise Exception("Jump point search is not supported by %s" % type(problem).__name__)
+        if self.mode == 'jps' and hasattr(self.problem, 'has_uniform_costs') and not self.problem.has_uniform_costs():
+            raise Exception("Jump point search needs every arc to have the same cost")
+
+        if self.mode == 'hpa' and not hasattr(self.problem, 'get_abstract_successors'):
+            raise Exception("Hierarchical search is not supported by %s" % type(problem).__name__)
+
+        if weight < 1 or weight_step <= 0:
+            raise Exception("The weight must be at least 1 and the weight step positive")
+        if self.mode == 'ara' and self.low_memory:
+            raise Exception("The ara mode expands nodes again, and cannot release their state in low memory mode")
+
+        self.weight = weight
+        self.weight_step = weight_step
+
+        # Children are only needed to propagate improved paths, which jump point and hierarchical search, whose
+        # arcs are not single steps, never have to do. The ara mode collects improved closed nodes instead
+        self.track_children = not self.low_memory and self.mode not in ('jps', 'ara', 'hpa')
+        # Insertion ordered, so the ara mode re-opens the inconsistent nodes in a deterministic order
+        self.incons = {}
+        self.bound = None
+
+        self.open_set = create_agenda(self.mode, self.problem, tie_break=tie_break, weight=weight)
         self.closed_set = set()
 
         self.start_node = self.problem.get_start_node()
@@ -76,8 +159,15 @@ class AStar(object):
         self.path = []
         self.parent_of = {}
 
-        if self.mode == 'best':
-            heapq.heapify(self.open_set)
+        # Search counters, read by the headless runner and benchmarks
+        self.stats = {
+            'expanded': 0,
+            'generated': 0,
+            'propagations': 0,
+            'reparented': 0,
+            'reopened': 0,
+            'solutions': 0
+        }
 
         log("A* initiated successfully")
 
@@ -85,92 +175,824 @@ class AStar(object):
         """
         The implementation of the A* algorithm. This is the main loop for the algorithm
         """
+        # Evaluate the start node, so problems that are solved up front are recognized as such
+        self.start_node.h = self.problem.heuristic(self.start_node)
+        self.start_node.f = self.start_node.g + self.weight * self.start_node.h
         self.add_node(self.start_node)
 
+        if self.mode == 'ara':
+            yield from self.anytime_loop()
+            return
+        step = None
+        node = None
+
         while len(self.open_set):
+            if self.low_memory and node is not None:
+                node.state = None
             node = self.take_node()
             self.closed_set.add(node)
+            self.stats['expanded'] += 1
 
             if node.is_goal:
                 log('Reached the goal node for this problem instance')
-                yield {
-                    'open_set': self.open_set,
-                    'closed_set': self.closed_set,
-                    'path': self.get_path_from_node([node])
-                }
-                break
+                self.goal_node = node
+                yield self.create_step(node, [])
+                return
 
-            successors = self.problem.get_all_successor_nodes(node) or []
+            opened = []
 
-            for successor in successors:
-                node.children.add(successor)
+            for successor, cost in self.get_successors(node):
+                if self.track_children:
+                    node.children.add(successor)
                 if successor not in self.closed_set and successor not in self.open_set:
-                    self.attach_and_eval(successor, node)
+                    self.attach_and_eval(successor, node, cost)
                     self.add_node(successor)
-                elif node.g + self.problem.arc_cost(node) < successor.g:
-                    self.attach_and_eval(successor, node)  # Returns f value, but is never used
+                    opened.append(successor)
+                    self.stats['generated'] += 1
+                elif node.g + cost < successor.g:
+                    self.attach_and_eval(successor, node, cost)
                     if successor in self.closed_set:
-                        debug('Reached closed node, propagating path')
-                        self.propagate_path(node)
-
-            # Yields the current open- and closed set to the function that called the agenda_loop
-            yield {
-                'open_set': self.open_set,
-                'closed_set': self.closed_set,
-                'path': self.get_path_from_node([node])
-            }
-
-    def attach_and_eval(self, successor, node):
-        self.parent_of[successor] = node
-        successor.g = node.g + self.problem.arc_cost(node)
+                        if self.track_children:
+                            debug('Reached closed node, propagating path')
+                            self.propagate_path(successor)
+                    else:
+                        self.reprioritize(successor)
+
+            # Yields what changed in this expansion to the function that called the agenda_loop
+            step = (node, opened)
+            if self.stats['expanded'] % self.snapshot_interval == 0:
+                yield self.create_step(node, opened)
+                step = None
+
+        # Make sure the caller always sees the last expansion of an exhausted search
+        if step is not None:
+            yield self.create_step(*step)
+
+    def anytime_loop(self):
+        """
+        Anytime repairing A*. Searches with a weighted heuristic until the best solution found costs no more than
+        the lowest F value in the open set, and reports it. The weight is then lowered and the search resumed from
+        the open set and the closed nodes that got a better G value, instead of starting over. Each solution step
+        carries the cost of the solution and a bound on how many times the optimal cost it can be.
+        Goal nodes are not expanded, and the loop ends when the bound reaches 1
+        """
+        step = None
+        reported = None
+
+        while True:
+            while len(self.open_set) and (self.goal_node is None or self.open_set.min_priority() < self.goal_node.g):
+                node = self.take_node()
+                self.closed_set.add(node)
+                self.stats['expanded'] += 1
+
+                if node.is_goal:
+                    if self.goal_node is None or node.g < self.goal_node.g:
+                        self.goal_node = node
+                    continue
+
+                opened = []
+
+                for successor, cost in self.get_successors(node):
+                    seen = successor in self.parent_of or successor is self.start_node
+                    if not seen or node.g + cost < successor.g:
+                        self.attach_and_eval(successor, node, cost)
+                        if not seen:
+                            opened.append(successor)
+                            self.stats['generated'] += 1
+                        if successor in self.closed_set:
+                            self.incons[successor] = None
+                        else:
+                            self.add_node(successor)
+
+                step = (node, opened)
+                if self.stats['expanded'] % self.snapshot_interval == 0:
+                    yield self.create_step(node, opened)
+                    step = None
+
+            if self.goal_node is None:
+                break
+
+            # The path can be cheaper than the G value of the goal, if a closed node on it improved after the goal
+            # was reached. The bound holds for both
+            path = self.get_path_from_node([self.goal_node])
+            cost = sum(self.problem.arc_cost(parent) for parent in path[1:])
+            bound = self.suboptimality_bound()
+            if (cost, bound) != reported:
+                reported = (cost, bound)
+                self.bound = bound
+                self.stats['solutions'] += 1
+                log('Found a solution with cost %s, at most %.3f times the optimal cost' % (cost, bound))
+                solution = self.create_step(self.goal_node, [])
+                solution['path'] = path
+                solution['solution_cost'] = cost
+                solution['bound'] = bound
+                yield solution
+                step = None
+
+            if bound <= 1:
+                return
+
+            # Lower the weight, move the inconsistent nodes back to the open set and order it by the new weight
+            self.weight = max(1.0, self.weight - self.weight_step)
+            for node in list(self.open_set) + list(self.incons):
+                node.f = node.g + self.weight * node.h
+                self.add_node(node)
+            self.incons.clear()
+            self.closed_set.clear()
+
+        # Make sure the caller always sees the last expansion of an exhausted search
+        if step is not None:
+            yield self.create_step(*step)
+
+    def suboptimality_bound(self):
+        """
+        Returns how many times the optimal cost the current solution can be, from the lowest unweighted F value
+        among the open and inconsistent nodes. Any cheaper solution has to pass through one of them
+        """
+        pending = list(self.open_set) + list(self.incons)
+        if not pending:
+            return 1.0
+        lowest = min(node.g + node.h for node in pending)
+        if lowest <= 0:
+            return self.weight
+        return max(1.0, min(self.weight, self.goal_node.g / lowest))
+
+    def create_step(self, node, opened):
+        """
+        Creates a step for the step stream. The path back to the start node is only built if the
+        caller reads the 'path' key, and is built from the parent links at the time it is read
+        :param node: The node that was expanded
+        :param opened: The nodes that were added to the open set by this expansion
+        :return: A SearchStep
+        """
+        return SearchStep(
+            lambda n: self.get_path_from_node([n]),
+            node=node,
+            parent=self.get_parent(node),
+            opened=opened,
+            open_set=self.open_set,
+            closed_set=self.closed_set
+        )
+
+    def get_parent(self, node):
+        """
+        Returns the parent of a node in the search tree, or None for the start node
+        """
+        if node is self.start_node:
+            return None
+        if self.low_memory:
+            return node.parent
+        return self.parent_of.get(node)
+
+    def get_successors(self, node):
+        """
+        Returns the successors of a node, paired with the cost of the arc to them.
+        In jps mode these are the jump points reachable from the node, with the length of the jump as cost,
+        and in hpa mode the abstract nodes connected to it
+        :param node: The node to expand
+        :return: A list of (successor, arc cost) tuples
+        """
+        if self.mode == 'jps':
+            return self.problem.get_jump_point_successors(node, self.get_parent(node))
+        if self.mode == 'hpa':
+            return self.problem.get_abstract_successors(node)
+
+        cost = self.problem.arc_cost(node)
+        return [(successor, cost) for successor in self.problem.get_all_successor_nodes(node) or []]
+
+    def attach_and_eval(self, successor, node, cost=None):
+        if cost is None:
+            cost = self.problem.arc_cost(node)
+        if self.low_memory:
+            successor.parent = node
+        else:
+            self.parent_of[successor] = node
+        successor.g = node.g + cost
         successor.h = self.problem.heuristic(successor)
-        successor.f = successor.g + successor.h
+        successor.f = successor.g + self.weight * successor.h
 
     def propagate_path(self, node):
-        for child in node.children:
-            if node.g + self.problem.arc_cost(node) < child.g:
-                self.parent_of[child] = node
-                child.g = node.g + self.problem.arc_cost(node)
-                child.h = self.problem.heuristic(child)
-                child.f = child.g + child.h
-                self.propagate_path(child)
+        """
+        Pushes the improved G value of a closed node down to its descendants. Iterative, with a guard so a node is
+        only queued once at a time, and the H values are kept since they do not depend on the path.
+        Open descendants are re-ordered in the open set. If more than propagation_budget nodes would be processed,
+        the remaining ones are reopened instead, and the improvement is picked up when they are expanded again
+        :param node: The closed node that got a better G value
+        """
+        self.stats['propagations'] += 1
+        queue = deque([node])
+        queued = {node}
+        processed = 0
+
+        while queue:
+            if self.propagation_budget is not None and processed >= self.propagation_budget:
+                for pending in queue:
+                    self.closed_set.discard(pending)
+                    self.add_node(pending)
+                self.stats['reopened'] += len(queue)
+                debug('Propagation budget exhausted, reopened %d nodes' % len(queue))
+                return
+
+            current = queue.popleft()
+            queued.discard(current)
+            processed += 1
+            cost = current.g + self.problem.arc_cost(current)
+
+            for child in current.children:
+                if cost < child.g:
+                    self.parent_of[child] = current
+                    child.g = cost
+                    child.f = child.g + self.weight * child.h
+                    self.stats['reparented'] += 1
+
+                    if child in self.open_set:
+                        self.reprioritize(child)
+                    elif child in self.closed_set and child not in queued:
+                        queued.add(child)
+                        queue.append(child)
 
     def add_node(self, node):
         """
-        Method to add the node to the open set depending on the mode
-        :param node: The node to append to the list
+        Method to add the node to the open set. The ordering is decided by the agenda picked for the mode
+        :param node: The node to add to the open set
         """
-        return {
-            'best': lambda: heapq.heappush(self.open_set, node),  # Insert to ascending heap queue
-            'bfs': lambda: self.open_set.append(node),  # Insert to back of queue (FIFO)
-            'dfs': lambda: self.open_set.insert(0, node)  # Insert to front of queue (LIFO)
-        }.get(self.mode)()
+        self.open_set.add(node, node.f, node.h)
+
+    def reprioritize(self, node):
+        """
+        Moves an open node whose F value has improved to its new position in the open set.
+        Only the best-first agenda is ordered by cost, so the blind agendas keep the node where it is
+        :param node: The open node that got a new F value
+        """
+        self.add_node(node)
 
     def take_node(self):
         """
-        Method to take the right node from the open set depending on the mode
+        Method to take the next node from the open set depending on the mode
         """
-        return {
-            'best': lambda: heapq.heappop(self.open_set),  # Get first element in queue
-            'bfs': lambda: self.open_set.pop(0),
-            'dfs': lambda: self.open_set.pop(0)
-        }.get(self.mode)()
+        return self.open_set.pop()
 
     def get_path_from_node(self, path):
         """
         This method returns a list containing a shallow copy of all node objects in the current path
         To be used with for instance the GUI visualisation
-        :param path:
-        :return:
+        :param path: A list ending in the node to walk back from
+        :return: The path, from the given node back to the start node
         """
-        while path[-1] != self.problem.get_start_node():
-            path.append(self.parent_of[path[-1]])
-        return path[::]
+        start_node = self.start_node
+        if self.low_memory:
+            while path[-1] is not start_node:
+                path.append(path[-1].parent)
+        else:
+            parent_of = self.parent_of
+            while path[-1] is not start_node:
+                path.append(parent_of[path[-1]])
+
+        if self.mode == 'jps':
+            return self.problem.expand_jump_path(path)
+        if self.mode == 'hpa':
+            return self.problem.expand_abstract_path(path)
+        return path
+
+
+class BidirectionalAStar(object):
+    """
+    Bidirectional best-first search. Runs one A* forward from the start node and one backward from the goal node,
+    always expanding the side with the smaller open set. The cheapest meeting point seen so far bounds the solution,
+    and the search stops when the lowest F value of either open set reaches that bound, which with consistent
+    heuristics guarantees the same path cost as unidirectional A*.
+
+    The problem must have a concrete goal node, symmetric successors, and implement
+    distance_estimate(node, target, reverse), where reverse bounds the distance from the target to the node instead.
+    The backward search estimates with reverse set, since arc costs need not be the same in both directions
+    :param mode: Must be 'bidirectional'
+    :param problem: The problem to run the search on
+    :param snapshot_interval: Only yield a step every N expansions. The goal step and the last step are always yielded
+    :param tie_break: 'fifo' or 'lifo', which of the nodes with equal F and H values the agendas take first
+    """
+
+    def __init__(self, mode='bidirectional', problem=None, snapshot_interval=1, tie_break='fifo'):
+        """
+        Initializing both search directions
+        """
+        if not isinstance(problem, AStarProblem):
+            raise Exception("Problem must be an instance of AStarProblem")
+        if problem.get_goal_node() is None or not hasattr(problem, 'distance_estimate'):
+            raise Exception("Bidirectional search is not supported by %s" % type(problem).__name__)
+
+        self.mode = mode
+        self.problem = problem
+        self.snapshot_interval = max(1, snapshot_interval)
+
+        self.start_node = problem.get_start_node()
+        self.goal_node = None
+
+        # Per direction state, index 0 is forward from the start and 1 is backward from the goal
+        self.roots = (self.start_node, problem.get_goal_node())
+        self.g = ({}, {})
+        self.parent_of = ({}, {})
+        self.open_sets = (PriorityAgenda(tie_break=tie_break), PriorityAgenda(tie_break=tie_break))
+        self.closed_sets = (set(), set())
+        self.open_set = UnionView(*self.open_sets)
+        self.closed_set = UnionView(*self.closed_sets)
+
+        self.best_cost = float('inf')
+        self.meeting_node = None
+
+        self.stats = {
+            'expanded': 0,
+            'generated': 0,
+            'expanded_forward': 0,
+            'expanded_backward': 0
+        }
+
+        log('Bidirectional A* initiated successfully')
+
+    def agenda_loop(self):
+        """
+        The main loop, alternating between the directions
+        """
+        for direction in (0, 1):
+            root = self.roots[direction]
+            h = self.problem.distance_estimate(root, self.roots[1 - direction], reverse=bool(direction))
+            self.g[direction][root] = 0
+            self.open_sets[direction].add(root, h, h)
+
+        if self.roots[0] is self.roots[1]:
+            self.best_cost = 0
+            self.meeting_node = self.roots[0]
+
+        step = None
+
+        while len(self.open_sets[0]) and len(self.open_sets[1]):
+            bound = max(self.open_sets[0].min_priority(), self.open_sets[1].min_priority())
+            if bound >= self.best_cost:
+                break
+
+            direction = 0 if len(self.open_sets[0]) <= len(self.open_sets[1]) else 1
+            node, opened = self.expand(direction)
+
+            step = (node, direction, opened)
+            if self.stats['expanded'] % self.snapshot_interval == 0:
+                yield self.create_step(node, direction, opened)
+                step = None
+
+        if self.meeting_node is not None:
+            log('Bidirectional search met at %s with cost %s' % (repr(self.meeting_node), self.best_cost))
+            self.goal_node = self.roots[1]
+            self.goal_node.g = self.best_cost
+            yield self.create_step(self.goal_node, None, [])
+        elif step is not None:
+            # Make sure the caller always sees the last expansion of an exhausted search
+            yield self.create_step(*step)
+
+    def expand(self, direction):
+        """
+        Expands the best open node in one direction
+        :param direction: 0 for forward, 1 for backward
+        :return: The expanded node and the nodes it opened
+        """
+        g, other_g = self.g[direction], self.g[1 - direction]
+        open_set, closed_set = self.open_sets[direction], self.closed_sets[direction]
+        target = self.roots[1 - direction]
+
+        node = open_set.pop()
+        closed_set.add(node)
+        self.stats['expanded'] += 1
+        self.stats['expanded_backward' if direction else 'expanded_forward'] += 1
+
+        opened = []
+        for successor in self.problem.get_all_successor_nodes(node) or []:
+            # Backwards, the arc runs from the successor to the node
+            cost = g[node] + self.problem.arc_cost(successor if direction else node)
+            if cost < g.get(successor, float('inf')):
+                if successor not in g:
+                    opened.append(successor)
+                    self.stats['generated'] += 1
+                g[successor] = cost
+                self.parent_of[direction][successor] = node
+                closed_set.discard(successor)
+                h = self.problem.distance_estimate(successor, target, reverse=bool(direction))
+                open_set.add(successor, cost + h, h)
+
+                if successor in other_g and cost + other_g[successor] < self.best_cost:
+                    self.best_cost = cost + other_g[successor]
+                    self.meeting_node = successor
+
+        return node, opened
+
+    def create_step(self, node, direction, opened):
+        """
+        Creates a step for the step stream. The path is built when the 'path' key is read
+        :param node: The node that was expanded
+        :param direction: 0 for forward, 1 for backward, None for the final step
+        :param opened: The nodes that were added to the open set by this expansion
+        :return: A SearchStep
+        """
+        return SearchStep(
+            lambda n: self.get_path_from_node([n]) if direction is None else self.get_branch(n, direction),
+            node=node,
+            parent=self.parent_of[direction].get(node) if direction is not None else None,
+            direction=direction,
+            opened=opened,
+            open_set=self.open_set,
+            closed_set=self.closed_set
+        )
+
+    def get_branch(self, node, direction):
+        """
+        Returns the path from a node back to the root of one direction
+        """
+        path = [node]
+        parent_of = self.parent_of[direction]
+        while path[-1] is not self.roots[direction]:
+            path.append(parent_of[path[-1]])
+        return path
+
+    def get_path_from_node(self, path):
+        """
+        Returns the full path through the meeting node, from the goal node back to the start node
+        :param path: Ignored, kept for compatibility with the AStar interface
+        :return: The path
+        """
+        backward = self.get_branch(self.meeting_node, 1)
+        forward = self.get_branch(self.meeting_node, 0)
+        return backward[::-1] + forward[1:]
+
+
+class IDAStar(object):
+    """
+    Iterative deepening A*. Runs depth-first searches bounded by the F value, raising the bound to the lowest
+    F value that was cut off until the goal is found. Only the current path and the pending siblings along it
+    are kept, so memory grows with the depth of the solution instead of the number of states seen.
+    States are revisited across iterations, and cycles are only caught along the current path.
+    Works with any AStarProblem
+    :param mode: Must be 'ida'
+    :param problem: The problem to run the search on
+    :param snapshot_interval: Only yield a step every N expansions. The goal step and the last step are always yielded
+    :param tie_break: 'fifo' or 'lifo', which of the successors with equal F and H values is visited first
+    """
+
+    def __init__(self, mode='ida', problem=None, snapshot_interval=1, tie_break='fifo'):
+        """
+        Initializing the IDA* object with the given parameters
+        """
+        if not isinstance(problem, AStarProblem):
+            raise Exception("Problem must be an instance of AStarProblem")
+
+        self.mode = mode
+        self.problem = problem
+        self.snapshot_interval = max(1, snapshot_interval)
+        self.tie_break = tie_break
+
+        self.start_node = problem.get_start_node()
+        self.goal_node = None
+
+        # Frames of (node, trail, pending successors). The trail is a (node, parent trail) chain back to the start
+        self.stack = []
+        self.open_set = FrontierView(self.stack)
+        self.closed_set = set()
+
+        self.bound = None
+        self.next_bound = None
+
+        self.stats = {
+            'expanded': 0,
+            'generated': 0,
+            'iterations': 0
+        }
+
+        log('IDA* initiated successfully')
+
+    def agenda_loop(self):
+        """
+        The main loop, one bounded depth-first search per iteration
+        """
+        start = self.start_node
+        start.h = self.problem.heuristic(start)
+        start.f = start.g + start.h
+        bound = start.f
+        step = None
+
+        while True:
+            self.stats['iterations'] += 1
+            self.bound = bound
+            self.next_bound = float('inf')
+            self.closed_set.clear()
+            self.stack.append((None, None, deque([(start, start.g, start.h)])))
+            debug('IDA* iteration %d with bound %s' % (self.stats['iterations'], bound))
+
+            while self.stack:
+                node, trail, pending = self.stack[-1]
+                if not pending:
+                    self.stack.pop()
+                    self.closed_set.discard(node)
+                    continue
+
+                node, g, h = pending.popleft()
+                node.g = g
+                node.f = g + h
+                trail = (node, trail)
+                self.closed_set.add(node)
+                self.stats['expanded'] += 1
+
+                if node.is_goal:
+                    log('Reached the goal node for this problem instance')
+                    self.goal_node = node
+                    yield self.create_step(trail, [])
+                    return
+
+                opened = self.expand(node, trail)
+
+                step = (trail, opened)
+                if self.stats['expanded'] % self.snapshot_interval == 0:
+                    yield self.create_step(trail, opened)
+                    step = None
+
+            if self.next_bound == float('inf'):
+                break
+            bound = self.next_bound
+
+        # Make sure the caller always sees the last expansion of an exhausted search
+        if step is not None:
+            yield self.create_step(*step)
+
+    def expand(self, node, trail):
+        """
+        Pushes a frame with the successors of a node that are within the bound and not on the current path.
+        Successors are visited in order of F and H, and the lowest F value above the bound is kept for the next iteration
+        :param node: The node to expand
+        :param trail: The trail ending in the node
+        :return: The successors that were pushed
+        """
+        cost = node.g + self.problem.arc_cost(node)
+        pending = []
+
+        for successor in self.problem.get_all_successor_nodes(node) or []:
+            if successor in self.closed_set:
+                continue
+            self.stats['generated'] += 1
+            h = self.problem.heuristic(successor)
+            if cost + h > self.bound:
+                self.next_bound = min(self.next_bound, cost + h)
+            else:
+                pending.append((successor, cost, h))
+
+        if self.tie_break == 'lifo':
+            pending.reverse()
+        pending.sort(key=lambda entry: (entry[1] + entry[2], entry[2]))
+
+        self.stack.append((node, trail, deque(pending)))
+        return [entry[0] for entry in pending]
+
+    def create_step(self, trail, opened):
+        """
+        Creates a step for the step stream. The trail is captured, so the path stays valid after the search moves on
+        :param trail: The trail ending in the node that was expanded
+        :param opened: The successors that were pushed by this expansion
+        :return: A SearchStep
+        """
+        return SearchStep(
+            lambda n: self.get_path_from_trail(trail),
+            node=trail[0],
+            parent=trail[1][0] if trail[1] else None,
+            opened=opened,
+            open_set=self.open_set,
+            closed_set=self.closed_set
+        )
+
+    @staticmethod
+    def get_path_from_trail(trail):
+        """
+        Returns the path from the end of a trail back to the start node
+        """
+        path = []
+        while trail is not None:
+            path.append(trail[0])
+            trail = trail[1]
+        return path
+
+
+class DStarLite(object):
+    """
+    D* Lite incremental replanning. Searches backward from the goal node, keeping for every node its distance to the
+    goal (G) and a one step lookahead of it (RHS). When arcs change, only the nodes whose distance is affected are
+    expanded again, so moving agents can replan without searching from scratch.
+
+    Run agenda_loop for the first plan. After changing the problem, pass the nodes whose arcs changed to update,
+    optionally move the agent with move_to, and run agenda_loop again to repair the plan.
+    Nodes with a false walkable attribute have no arcs. The problem must have a concrete goal node, symmetric
+    successors, and implement distance_estimate(node, target) with an estimate that stays admissible when arcs change
+    :param mode: Must be 'dstar'
+    :param problem: The problem to run the search on
+    :param snapshot_interval: Only yield a step every N expansions. The goal step and the last step are always yielded
+    :param tie_break: 'fifo' or 'lifo', which of the nodes with equal keys the agenda takes first
+    """
+
+    def __init__(self, mode='dstar', problem=None, snapshot_interval=1, tie_break='fifo'):
+        """
+        Initializing the search from the goal node
+        """
+        if not isinstance(problem, AStarProblem):
+            raise Exception("Problem must be an instance of AStarProblem")
+        if problem.get_goal_node() is None or not hasattr(problem, 'distance_estimate'):
+            raise Exception("D* Lite is not supported by %s" % type(problem).__name__)
+        if getattr(problem, 'mode', None) in ('landmarks', 'exact'):
+            raise Exception("The %s heuristic is not admissible once obstacles change" % problem.mode)
+
+        self.mode = mode
+        self.problem = problem
+        self.snapshot_interval = max(1, snapshot_interval)
+
+        self.start_node = problem.get_start_node()
+        self.target = problem.get_goal_node()
+        self.goal_node = None
+
+        self.g = {}
+        self.rhs = {self.target: 0}
+        self.km = 0
+        self.last_start = self.start_node
+
+        self.open_set = PriorityAgenda(tie_break=tie_break)
+        self.open_set.add(self.target, *self.key(self.target))
+        self.closed_set = set()
+
+        self.stats = {
+            'expanded': 0,
+            'generated': 1,
+            'updated': 0,
+            'replans': 0
+        }
+
+        log('D* Lite initiated successfully')
+
+    def key(self, node):
+        """
+        Returns the priority of a node. The original D* Lite takes nodes with equal first keys by their distance to
+        the goal, which on open boards expands every node with the same key before reaching the start. Here they are
+        taken closest to the start first, like the H tie breaking of the A* agenda, except for nodes whose distance
+        got worse. Those still come first, so the loop never stops while the planned path runs through one of them
+        """
+        g = self.g.get(node, float('inf'))
+        rhs = self.rhs.get(node, float('inf'))
+        h = self.problem.distance_estimate(self.start_node, node)
+        return min(g, rhs) + h + self.km, -1 if g < rhs else h
+
+    def cost(self, node, successor):
+        """
+        Returns the cost of the arc between two adjacent nodes, infinite if either of them is blocked
+        """
+        if not getattr(node, 'walkable', True) or not getattr(successor, 'walkable', True):
+            return float('inf')
+        return self.problem.arc_cost(node)
+
+    def neighbours(self, node):
+        """
+        Returns the nodes adjacent to a node. Successors and predecessors are the same on symmetric problems
+        """
+        return self.problem.get_all_successor_nodes(node) or []
+
+    def update_vertex(self, node):
+        """
+        Recomputes the lookahead value of a node, and puts it on the agenda if it became inconsistent
+        """
+        if node is not self.target:
+            if node not in self.rhs and node not in self.g:
+                self.stats['generated'] += 1
+            self.rhs[node] = min(
+                [self.cost(node, successor) + self.g.get(successor, float('inf'))
+                 for successor in self.neighbours(node)] or [float('inf')]
+            )
+
+        self.open_set.discard(node)
+        if self.g.get(node, float('inf')) != self.rhs.get(node, float('inf')):
+            self.open_set.add(node, *self.key(node))
+
+    def agenda_loop(self):
+        """
+        Computes or repairs the shortest path from the current start node, expanding only inconsistent nodes
+        """
+        start = self.start_node
+        self.goal_node = None
+        self.closed_set.clear()
+        step = None
+
+        while len(self.open_set):
+            if self.open_set.min_key() >= self.key(start) and \
+                    self.rhs.get(start, float('inf')) == self.g.get(start, float('inf')):
+                break
+
+            old_key = self.open_set.min_key()
+            node = self.open_set.pop()
+            new_key = self.key(node)
+
+            if old_key < new_key:
+                self.open_set.add(node, *new_key)
+                continue
+
+            self.closed_set.add(node)
+            self.stats['expanded'] += 1
+
+            if self.g.get(node, float('inf')) > self.rhs[node]:
+                self.g[node] = self.rhs[node]
+                for predecessor in self.neighbours(node):
+                    self.update_vertex(predecessor)
+            else:
+                self.g[node] = float('inf')
+                for predecessor in self.neighbours(node) + [node]:
+                    self.update_vertex(predecessor)
+
+            step = node
+            if self.stats['expanded'] % self.snapshot_interval == 0:
+                yield self.create_step(node)
+                step = None
+
+        if self.g.get(start, float('inf')) < float('inf'):
+            log('Planned a path with cost %s' % self.g[start])
+            self.goal_node = self.target
+            self.goal_node.g = self.g[start]
+            yield self.create_step(self.goal_node)
+        elif step is not None:
+            # Make sure the caller always sees the last expansion of an exhausted search
+            yield self.create_step(step)
+
+    def update(self, nodes):
+        """
+        Registers nodes whose arcs have changed, like board cells that were blocked or cleared.
+        Run agenda_loop afterwards to repair the plan
+        :param nodes: The changed nodes
+        """
+        self.km += self.problem.distance_estimate(self.last_start, self.start_node)
+        self.last_start = self.start_node
+        self.stats['replans'] += 1
+
+        for node in nodes:
+            for affected in self.neighbours(node) + [node]:
+                self.update_vertex(affected)
+                self.stats['updated'] += 1
+
+    def move_to(self, node):
+        """
+        Moves the start of the plan, for agents that follow the path while replanning
+        :param node: The new start node
+        """
+        self.start_node = node
+
+    def create_step(self, node):
+        """
+        Creates a step for the step stream. The path is built from the current distances when read
+        """
+        return SearchStep(
+            lambda n: self.get_path_from_node([n]),
+            node=node,
+            parent=None,
+            opened=[],
+            open_set=self.open_set,
+            closed_set=self.closed_set
+        )
+
+    def get_path_from_node(self, path):
+        """
+        Returns the planned path, from the goal node back to the start node. Until a plan exists,
+        this is just the given node
+        :param path: A list ending in the node the step is about
+        :return: The path
+        """
+        if self.goal_node is None:
+            return path
+
+        node = self.start_node
+        path = [node]
+        while node is not self.target:
+            node = min(self.neighbours(node), key=lambda s: self.cost(node, s) + self.g.get(s, float('inf')))
+            path.append(node)
+
+        return path[::-1]
+
+
+# Modes that are run by another engine than AStar
+ASTAR_ENGINES = {
+    'bidirectional': BidirectionalAStar,
+    'ida': IDAStar,
+    'dstar': DStarLite
+}
+
+
+def create_search(problem, mode='best', **options):
+    """
+    Creates the search engine for a mode
+    :param problem: The problem to search
+    :param mode: One of the ASTAR_OPTIONS
+    :param options: Extra keyword arguments for the engine
+    :return: An AStar, or the engine registered for the mode in ASTAR_ENGINES
+    """
+    return ASTAR_ENGINES.get(mode, AStar)(mode=mode, problem=problem, **options)
 
 # --- Generalized Arc Constraint ---
 
 GAC_DEFAULT_CONSTRAINT = 'x != y'
 GAC_DEFAULT_K = 4
+GAC_DEFAULT_ENGINE = 'ac3'
 
 
 class GAC(object):
@@ -178,14 +1000,37 @@ class GAC(object):
     def __init__(self, cnet=None, csp_state=None, cf=lambda x, y: x != y):
         """
         Constructor for the GAC algorithm
-        :param cnet:
-        :param csp_state:
-        :return:
+        :param cnet: Constraint network, mapping every node to the nodes it has constraints against
+        :param csp_state: The CSPState holding the domains to filter
+        :param cf: Constraint function, cf(x, y) is true if x in the domain of a node is supported by y in the
+        domain of the node it has a constraint against
         """
         self.csp_state = csp_state
         self.cnet = cnet
         self.cf = cf
-        self.queue = []
+
+        # FIFO queue of (node, node it is revised against) arcs, with a set next to it so an arc is only queued once
+        self.queue = deque()
+        self.queued = set()
+
+        # Propagation counters, in total and for the last run of the domain filtering loop
+        self.stats = {
+            'runs': 0,
+            'revisions': 0,
+            'checks': 0,
+            'removals': 0
+        }
+        self.last_run = dict(self.stats)
+
+    def enqueue(self, from_node, to_node):
+        """
+        Adds an arc to the back of the revise queue, unless it is already queued
+        :param from_node: The node whose domain is revised
+        :param to_node: The node it is revised against
+        """
+        if (from_node, to_node) not in self.queued:
+            self.queued.add((from_node, to_node))
+            self.queue.append((from_node, to_node))
 
     def initialize(self):
         """
@@ -193,56 +1038,84 @@ class GAC(object):
         :return:
         """
         for node, edges in self.cnet.items():
-            self.queue.extend((node, edge) for edge in edges)
+            for edge in edges:
+                self.enqueue(node, edge)
 
         log('Queue initialized with %d pairs' % len(self.queue))
 
-    def revise(self, from_node):
+    def revise(self, from_node, to_node):
         """
-        Removes all inconsistent values in a domain for all possible arc from an node
-        It also saves to the csp_state if the current state is a contradiction
-        :param from_node: The node to run revise from
+        Removes the values in the domain of a node that have no support in the domain of the node it is revised
+        against. It also saves to the csp_state if the current state is a contradiction
+        :param from_node: The node to revise the domain of
+        :param to_node: The node to look for supports in
         :return: Boolean telling whether the domain was revised or not
         """
-        to_be_removed = []
-        for arc in self.cnet[from_node]:
-            for domain in self.csp_state.nodes[from_node]:
-                remove = True
-                for x, y in product([domain], self.csp_state.nodes[arc]):
-                    if self.cf(x, y):
-                        remove = False
-                        break
-
-                if remove:
-                    if DEBUG:
-                        print('Removing domain %s from %s' % (str(domain), from_node))
-                    to_be_removed.append(domain)
-
-        for domain in to_be_removed:
-            if domain in self.csp_state.nodes[from_node]:
-                self.csp_state.nodes[from_node].remove(domain)
-
-        if to_be_removed:
-            if not self.csp_state.nodes[from_node]:
-                self.csp_state.contradiction = True
+        cf = self.cf
+        domain = self.csp_state.nodes[from_node]
+        others = self.csp_state.nodes[to_node]
+        kept = []
+        checks = 0
+
+        for x in domain:
+            for y in others:
+                checks += 1
+                if cf(x, y):
+                    kept.append(x)
+                    break
+            else:
                 if DEBUG:
-                    print('Contradiction')
-            return True
+                    print('Removing domain %s from %s' % (str(x), from_node))
 
-        return False
+        self.last_run['revisions'] += 1
+        self.last_run['checks'] += checks
+
+        return self.update_domain(from_node, domain, kept)
+
+    def update_domain(self, node, domain, kept):
+        """
+        Replaces the domain of a node with the values revise kept, flagging a contradiction if none are left
+        :param node: The revised node
+        :param domain: The domain the node had before revise
+        :param kept: The values of the domain that were supported
+        :return: Boolean telling whether the domain was revised or not
+        """
+        if len(kept) == len(domain):
+            return False
+
+        self.last_run['removals'] += len(domain) - len(kept)
+        self.csp_state.nodes[node] = type(domain)(kept)
+        if not kept:
+            self.csp_state.contradiction = True
+            if DEBUG:
+                print('Contradiction')
+
+        return True
 
     def domain_filtering_loop(self):
         """
-        Pops of all todo revise pairs from the queue and runs revise on the from_node
-        If the domains is revised it will add all other possible constraints from the from_node to the revise queue to
-        check for further domain reductions possible
+        Pops of all todo revise pairs from the queue and runs revise on the arc
+        If the domain is revised it will add all arcs towards the revised node to the revise queue to
+        check for further domain reductions possible. Stops at the first contradiction
         """
+        self.last_run = dict.fromkeys(self.stats, 0)
+        self.last_run['runs'] = 1
+
         while self.queue:
-            from_node, to_node = self.queue.pop(0)
-            if self.revise(from_node):
+            from_node, to_node = self.queue.popleft()
+            self.queued.discard((from_node, to_node))
+
+            if self.revise(from_node, to_node):
+                if self.csp_state.contradiction:
+                    self.queue.clear()
+                    self.queued.clear()
+                    break
                 for arc in self.cnet[from_node]:
                     if arc != from_node:
-                        self.queue.append((arc, from_node))
+                        self.enqueue(arc, from_node)
+
+        for key, value in self.last_run.items():
+            self.stats[key] += value
 
     def run_again(self, node):
         """
@@ -251,5 +1124,158 @@ class GAC(object):
         """
         for arc in self.cnet[node]:
             if node != arc:
-                self.queue.append((arc, node))
+                self.enqueue(arc, node)
         self.domain_filtering_loop()
+
+    def assign(self, node, domain):
+        """
+        Derives a child of the current state with the domain of a node reduced, and propagates the change in the child.
+        The child shares every domain that is not revised with the current state, which is left untouched, so one
+        state can be branched on for every value without copying it
+        :param node: The node to reduce the domain of
+        :param domain: The new domain of the node
+        :return: The child CSPState, or None if the reduction leads to a contradiction
+        """
+        parent = self.csp_state
+        child = parent.derive()
+        child.nodes[node] = domain
+
+        self.csp_state = child
+        self.run_again(node)
+        self.csp_state = parent
+
+        return None if child.contradiction else child
+
+
+class ResidualGAC(GAC):
+    """
+    GAC with residual supports (AC-3rm). The support found for a value on an arc is remembered, and the next time the
+    arc is revised the value is kept right away if that support is still in the domain of the other node. Only values
+    whose residue was pruned are searched for a new support from scratch. Since the constraint function never changes,
+    the residues stay valid hints across every state the GAC object filters, so they pay off most when the same
+    arcs are revised over and over by run_again during search.
+    Residues are looked up by the identity of the values instead of by equality, so large values like nonogram patterns
+    are never hashed. Domains are only ever filtered, so a value keeps its identity in every state it is part of.
+    Domains are replaced instead of changed, so the ids of the values of the last domain seen for every node are cached,
+    and a residue is checked against a domain in constant time without scanning it.
+    Not registered in GAC_ENGINES: it does fewer constraint checks, but on the bundled graphs and nonograms the domains
+    are small and the constraint functions cheap, so the residue bookkeeping still costs more than plain AC-3 saves
+    """
+
+    def __init__(self, cnet=None, csp_state=None, cf=lambda x, y: x != y):
+        """
+        Constructor, see GAC
+        """
+        super(ResidualGAC, self).__init__(cnet=cnet, csp_state=csp_state, cf=cf)
+
+        # (node, node it is revised against) -> {id(value): (value, supporting value)}. The value is kept in the entry
+        # so its id is never reused by another object while the residue exists
+        self.residues = {}
+        # node -> (last domain seen for the node, ids of its values)
+        self.members = {}
+        self.stats['residues'] = 0
+        self.last_run = dict(self.stats)
+
+    def revise(self, from_node, to_node):
+        """
+        Removes the values in the domain of a node that have no support in the domain of the node it is revised
+        against, trying the residual support of every value first
+        :param from_node: The node to revise the domain of
+        :param to_node: The node to look for supports in
+        :return: Boolean telling whether the domain was revised or not
+        """
+        cf = self.cf
+        domain = self.csp_state.nodes[from_node]
+        others = self.csp_state.nodes[to_node]
+        present = self.get_members(to_node, others)
+        residues = self.residues.setdefault((from_node, to_node), {})
+        kept = []
+        checks = 0
+        hits = 0
+
+        for x in domain:
+            residue = residues.get(id(x))
+            if residue is not None and residue[0] is x and id(residue[1]) in present:
+                hits += 1
+                kept.append(x)
+                continue
+
+            for y in others:
+                checks += 1
+                if cf(x, y):
+                    residues[id(x)] = (x, y)
+                    kept.append(x)
+                    break
+            else:
+                if DEBUG:
+                    print('Removing domain %s from %s' % (str(x), from_node))
+
+        self.last_run['revisions'] += 1
+        self.last_run['checks'] += checks
+        self.last_run['residues'] += hits
+
+        return self.update_domain(from_node, domain, kept)
+
+    def get_members(self, node, domain):
+        """
+        Returns the ids of the values in a domain, only building them again when the domain of the node was replaced
+        :param node: The node the domain belongs to
+        :param domain: The current domain of the node
+        :return: A set of value ids
+        """
+        cached = self.members.get(node)
+        if cached is not None and cached[0] is domain:
+            return cached[1]
+
+        present = {id(y) for y in domain}
+        self.members[node] = (domain, present)
+        return present
+
+
+class BitsetGAC(GAC):
+    """
+    GAC specialised for the x != y constraint of graph coloring, on a BitsetCSPState. A value of a node only loses its
+    last support when the node it is revised against is down to that single value, so revise is a handful of bit
+    operations per arc: nothing happens unless the other domain is a singleton, and then its bit is cleared.
+    The constraint function is not used
+    """
+
+    def revise(self, from_node, to_node):
+        """
+        Clears the value of a singleton domain from the domain of a node it has a constraint against
+        :param from_node: The node to revise the domain of
+        :param to_node: The node to look for supports in
+        :return: Boolean telling whether the domain was revised or not
+        """
+        masks = self.csp_state.masks
+        index = self.csp_state.index
+        other = masks[index[to_node]]
+
+        self.last_run['revisions'] += 1
+        self.last_run['checks'] += 1
+
+        # Two or more values left always support every value, and an empty domain is already a contradiction
+        if other & (other - 1) or not other:
+            return False
+
+        position = index[from_node]
+        domain = masks[position]
+        if not domain & other:
+            return False
+
+        masks[position] = domain & ~other
+        self.csp_state.total -= 1
+        self.last_run['removals'] += 1
+        if not masks[position]:
+            self.csp_state.contradiction = True
+            if DEBUG:
+                print('Contradiction')
+
+        return True
+
+
+# Propagation engines, selected by name per problem. The bitset engine only propagates x != y on graph colorings
+GAC_ENGINES = {
+    'ac3': GAC,
+    'bitset': BitsetGAC
+}
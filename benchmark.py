@@ -0,0 +1,403 @@
+# -*- coding: utf8 -*-
+
+import argparse
+import itertools
+import json
+import math
+import multiprocessing
+import platform
+import random
+import statistics
+import sys
+import tracemalloc
+from datetime import datetime
+
+from common import *
+from datastructures import AStarState, Graph
+from module1.navigation import NavigationProblem, read_board
+from solver import run_file, run_batch
+
+BENCHMARK_REPEAT = 5
+BENCHMARK_TIME_LIMIT = 20  # seconds per run, including loading the problem
+BENCHMARK_THRESHOLD = 0.10  # relative slowdown that is considered a regression
+BENCHMARK_ALPHA = 0.05  # significance level for the permutation test
+BENCHMARK_BOARD_MODES = ['best', 'bfs', 'dfs', 'jps', 'bidirectional', 'hpa']
+BENCHMARK_BOARD_HEURISTICS = ['landmarks', 'exact']  # Extra heuristics besides the default, run in best-first mode
+BENCHMARK_GRAPH_K = [3, 4, 5]
+BENCHMARK_NONOGRAM_MODES = ['ida']  # Extra modes besides the default best-first run
+BENCHMARK_GRAPH_ENGINES = ['bitset']  # Extra propagation engines besides the default
+PERMUTATION_SAMPLES = 10000
+# Queries on boards with terrain where a search once returned a costlier path than plain best-first search
+BENCHMARK_COST_QUERIES = {
+    'module1/boards/board6.txt': [((28, 1), (22, 17))]
+}
+BENCHMARK_COST_MODES = ['bidirectional']
+BENCHMARK_COST_HEURISTICS = ['manhattan', 'landmarks', 'exact']
+
+
+def collect_cases():
+    """
+    Builds the list of benchmark cases from every bundled board, graph and nonogram
+    :return: A list of (case id, run_file keyword arguments) pairs
+    """
+
+    cases = []
+    for board in sorted(fetch_files_from_dir(rootdir='module1/boards/')):
+        # Jump point search needs every arc to have the same cost, so boards with terrain skip it
+        terrain = read_board(board)[5]
+        for mode in BENCHMARK_BOARD_MODES:
+            if mode == 'jps' and terrain:
+                continue
+            cases.append((
+                'board:%s:%s' % (os.path.basename(board), mode),
+                {'file_path': board, 'problem_type': 'board', 'mode': mode}
+            ))
+        for heuristic in BENCHMARK_BOARD_HEURISTICS:
+            cases.append((
+                'board:%s:best:%s' % (os.path.basename(board), heuristic),
+                {'file_path': board, 'problem_type': 'board', 'heuristic': heuristic}
+            ))
+    for graph in sorted(fetch_files_from_dir(rootdir='module2/graphs/')):
+        for k in BENCHMARK_GRAPH_K:
+            cases.append((
+                'graph:%s:k=%d' % (os.path.basename(graph), k),
+                {'file_path': graph, 'problem_type': 'graph', 'k': k}
+            ))
+            for engine in BENCHMARK_GRAPH_ENGINES:
+                cases.append((
+                    'graph:%s:k=%d:%s' % (os.path.basename(graph), k, engine),
+                    {'file_path': graph, 'problem_type': 'graph', 'k': k, 'engine': engine}
+                ))
+    for nonogram in sorted(fetch_files_from_dir(rootdir='module3/nonograms/')):
+        cases.append((
+            'nonogram:%s' % os.path.basename(nonogram),
+            {'file_path': nonogram, 'problem_type': 'nonogram'}
+        ))
+        for mode in BENCHMARK_NONOGRAM_MODES:
+            cases.append((
+                'nonogram:%s:%s' % (os.path.basename(nonogram), mode),
+                {'file_path': nonogram, 'problem_type': 'nonogram', 'mode': mode}
+            ))
+
+    return cases
+
+
+def _run_case_in_child(kwargs, conn):
+    """
+    Runs a single case and sends the result back to the parent process
+    """
+
+    logging.disable(logging.CRITICAL)
+    conn.send(run_file(**kwargs))
+    conn.close()
+
+
+def run_case(kwargs, time_limit, trace_memory=False):
+    """
+    Runs a single case in a fresh process, so memory peaks are not polluted by earlier cases
+    and problems that never finish loading can be killed
+    :param kwargs: Keyword arguments for solver.run_file
+    :param time_limit: Seconds before the run is aborted
+    :param trace_memory: Whether to trace the peak memory of the search
+    :return: The run_file result, or None if the process had to be killed
+    """
+
+    kwargs = dict(kwargs, time_limit=time_limit, trace_memory=trace_memory)
+    parent_conn, child_conn = multiprocessing.Pipe(duplex=False)
+    process = multiprocessing.Process(target=_run_case_in_child, args=(kwargs, child_conn))
+    process.start()
+
+    result = None
+    if parent_conn.poll(time_limit + 5):
+        result = parent_conn.recv()
+    process.join(1)
+    if process.is_alive():
+        process.terminate()
+        process.join()
+
+    return result
+
+
+def benchmark(cases, repeat=BENCHMARK_REPEAT, time_limit=BENCHMARK_TIME_LIMIT):
+    """
+    Runs every case a number of times, and once more with memory tracing enabled
+    :return: A dictionary with the measurements of every case
+    """
+
+    results = {}
+    for case_id, kwargs in cases:
+        log('Benchmarking %s' % case_id)
+        times = []
+        load_times = []
+        result = None
+
+        for i in range(repeat):
+            result = run_case(kwargs, time_limit)
+            if result is None or result['status'] == 'timeout':
+                break
+            times.append(result['load_time'] + result['wall_time'])
+            load_times.append(result['load_time'])
+
+        entry = {
+            'status': result['status'] if result else 'timeout',
+            'times': times,
+            'load_times': load_times
+        }
+        if entry['status'] != 'timeout':
+            entry['expansions'] = result['expansions']
+            entry['path_length'] = result['path_length']
+
+            traced = run_case(kwargs, time_limit, trace_memory=True)
+            entry['peak_memory'] = traced['peak_memory'] if traced else None
+
+        results[case_id] = entry
+        print('%-40s %-10s %s' % (case_id, entry['status'], format_times(times)), file=sys.stderr)
+
+    annotate_bidirectional(results)
+
+    return results
+
+
+def annotate_bidirectional(results):
+    """
+    Stores how many expansions the bidirectional search saved compared to unidirectional best-first
+    search on the same board, negative if it expanded more
+    :param results: The cases dictionary from benchmark
+    """
+
+    for case_id, entry in results.items():
+        if not case_id.startswith('board:') or not case_id.endswith(':bidirectional'):
+            continue
+        best = results.get(case_id[:-len('bidirectional')] + 'best')
+        if best and 'expansions' in best and 'expansions' in entry:
+            entry['expansions_saved'] = best['expansions'] - entry['expansions']
+            print('%-40s %+d expansions saved' % (case_id, entry['expansions_saved']), file=sys.stderr)
+
+
+def check_path_costs(time_limit=BENCHMARK_TIME_LIMIT, case_filter=''):
+    """
+    Solves the cost regression queries in every checked mode and heuristic, and compares the path costs with
+    best-first search using the same heuristic
+    :param time_limit: Seconds per search
+    :param case_filter: Only check queries whose id contains this string
+    :return: A list of (query id, description) tuples for the queries that did not find the cheapest path
+    """
+
+    failures = []
+    for board, queries in sorted(BENCHMARK_COST_QUERIES.items()):
+        for heuristic in BENCHMARK_COST_HEURISTICS:
+            for mode in BENCHMARK_COST_MODES:
+                checked = [
+                    ('query:%s:%s:%s:%s->%s' % (os.path.basename(board), mode, heuristic, start, goal), (start, goal))
+                    for start, goal in queries
+                ]
+                checked = [(query_id, query) for query_id, query in checked if case_filter in query_id]
+                if not checked:
+                    continue
+
+                log('Checking path costs of %d queries on %s' % (len(checked), board))
+                subset = [query for query_id, query in checked]
+                expected = run_batch(board, subset, heuristic=heuristic, time_limit=time_limit)['results']
+                found = run_batch(board, subset, mode=mode, heuristic=heuristic, time_limit=time_limit)['results']
+                for (query_id, query), best, result in zip(checked, expected, found):
+                    if result['path_cost'] != best['path_cost']:
+                        failures.append((query_id, 'path cost %s, best-first found %s' % (
+                            result['path_cost'], best['path_cost']
+                        )))
+
+    return failures
+
+
+def measure_node_memory(samples=10000):
+    """
+    Measures the traced memory per node object when loading the largest bundled board and graph,
+    and when creating bare AStarState objects like the VC and nonogram searches do
+    :param samples: Number of bare AStarState objects to create
+    :return: A dictionary from measurement to bytes per node
+    """
+
+    def traced(factory):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        keep = factory()
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        del keep
+        return used
+
+    def area(board):
+        width, height = read_board(board)[:2]
+        return width * height
+
+    results = {}
+
+    board = max(sorted(fetch_files_from_dir(rootdir='module1/boards/')), key=area)
+    results['board:%s' % os.path.basename(board)] = traced(lambda: NavigationProblem(board)) / area(board)
+
+    graph = max(sorted(fetch_files_from_dir(rootdir='module2/graphs/')), key=os.path.getsize)
+    nodes = len(list(Graph.read_graph_from_file(graph)[0]))
+    results['graph:%s' % os.path.basename(graph)] = traced(lambda: Graph.read_graph_from_file(graph)) / nodes
+
+    results['astar_state'] = traced(lambda: [AStarState() for _ in range(samples)]) / samples
+
+    for measurement, size in sorted(results.items()):
+        print('%-40s %.1f bytes per node' % (measurement, size), file=sys.stderr)
+
+    return results
+
+
+def format_times(times):
+    """
+    Formats a list of timings as mean and standard deviation
+    """
+
+    if not times:
+        return '-'
+    if len(times) == 1:
+        return '%.4fs' % times[0]
+    return '%.4fs +- %.4fs' % (statistics.mean(times), statistics.stdev(times))
+
+
+def permutation_test(baseline, current):
+    """
+    One sided permutation test on the difference of means, checking whether the current timings are
+    slower than the baseline timings. Exact for small samples, Monte Carlo sampled for larger ones
+    :param baseline: Timings from the baseline
+    :param current: Timings from the current run
+    :return: The p-value
+    """
+
+    observed = statistics.mean(current) - statistics.mean(baseline)
+    pooled = baseline + current
+    n = len(current)
+    total = sum(pooled)
+
+    def at_least_as_extreme(indices):
+        picked = sum(pooled[i] for i in indices)
+        return picked / n - (total - picked) / len(baseline) >= observed - 1e-12
+
+    all_indices = range(len(pooled))
+    combinations = math.comb(len(pooled), n)
+    if combinations <= PERMUTATION_SAMPLES:
+        hits = sum(at_least_as_extreme(c) for c in itertools.combinations(all_indices, n))
+        return hits / combinations
+
+    rng = random.Random(0)
+    hits = sum(at_least_as_extreme(rng.sample(all_indices, n)) for _ in range(PERMUTATION_SAMPLES))
+    return (hits + 1) / (PERMUTATION_SAMPLES + 1)
+
+
+def compare(baseline, current, threshold=BENCHMARK_THRESHOLD, alpha=BENCHMARK_ALPHA):
+    """
+    Compares two benchmark results and reports regressions
+    :param baseline: The cases dictionary of the baseline
+    :param current: The cases dictionary of the current run
+    :param threshold: Relative slowdown or memory growth that is considered a regression
+    :param alpha: Significance level for timing regressions
+    :return: A list of (case id, description) tuples describing the regressions
+    """
+
+    regressions = []
+    for case_id in sorted(set(baseline) & set(current)):
+        old = baseline[case_id]
+        new = current[case_id]
+
+        if old['status'] != new['status']:
+            if new['status'] == 'timeout' or old['status'] == 'solved':
+                regressions.append((case_id, 'status changed from %s to %s' % (old['status'], new['status'])))
+            continue
+        if new['status'] == 'timeout':
+            continue
+
+        if new.get('expansions') != old.get('expansions'):
+            print('%-40s expansions %s -> %s' % (case_id, old.get('expansions'), new.get('expansions')),
+                  file=sys.stderr)
+
+        old_mean = statistics.mean(old['times'])
+        new_mean = statistics.mean(new['times'])
+        change = (new_mean - old_mean) / old_mean if old_mean else 0.0
+        p = permutation_test(old['times'], new['times'])
+        print('%-40s %+7.1f%% (p=%.3f)' % (case_id, change * 100, p), file=sys.stderr)
+
+        if change > threshold and p < alpha:
+            regressions.append((case_id, 'time %+.1f%% (p=%.3f)' % (change * 100, p)))
+
+        old_memory = old.get('peak_memory')
+        new_memory = new.get('peak_memory')
+        if old_memory and new_memory and new_memory > old_memory * (1 + threshold):
+            regressions.append((case_id, 'peak memory %d -> %d bytes' % (old_memory, new_memory)))
+
+    return regressions
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    """
+
+    parser = argparse.ArgumentParser(description='Benchmarks A* and GAC on the bundled problems')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser('run', help='Run the benchmarks and write a JSON baseline')
+    run_parser.add_argument('--output', default='baseline.json')
+
+    compare_parser = subparsers.add_parser('compare', help='Run the benchmarks and compare with a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('--output', default=None, help='Also store the new results')
+    compare_parser.add_argument('--threshold', type=float, default=BENCHMARK_THRESHOLD)
+    compare_parser.add_argument('--alpha', type=float, default=BENCHMARK_ALPHA)
+
+    costs_parser = subparsers.add_parser('costs', help='Check that every mode finds the cheapest path on the '
+                                                       'cost regression queries')
+
+    for p in (run_parser, compare_parser, costs_parser):
+        p.add_argument('--time-limit', type=float, default=BENCHMARK_TIME_LIMIT)
+        p.add_argument('--filter', default='', help='Only run cases whose id contains this string')
+    for p in (run_parser, compare_parser):
+        p.add_argument('--repeat', type=int, default=BENCHMARK_REPEAT)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(stream=sys.stderr, level=logging.WARNING)
+
+    if args.command == 'costs':
+        failures = check_path_costs(time_limit=args.time_limit, case_filter=args.filter)
+        for query_id, description in failures:
+            print('SUBOPTIMAL %-40s %s' % (query_id, description))
+        if failures:
+            sys.exit(1)
+        return
+
+    cases = [case for case in collect_cases() if args.filter in case[0]]
+    results = {
+        'meta': {
+            'date': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'repeat': args.repeat,
+            'time_limit': args.time_limit
+        },
+        'cases': benchmark(cases, repeat=args.repeat, time_limit=args.time_limit),
+        'node_memory': measure_node_memory()
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.command == 'compare':
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline['cases'], results['cases'], threshold=args.threshold, alpha=args.alpha)
+        for measurement, size in sorted(results['node_memory'].items()):
+            before = baseline.get('node_memory', {}).get(measurement)
+            if before:
+                print('%-40s %.1f -> %.1f bytes per node' % (measurement, before, size), file=sys.stderr)
+        for case_id, description in regressions:
+            print('REGRESSION %-40s %s' % (case_id, description))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
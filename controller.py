@@ -183,10 +183,14 @@ class MainController(object):
                     )
                     return
 
-            a = AStar(
-                problem=self.window.renderer.board,
-                mode=self.references['algorithm_mode'].get()
-            )
+            try:
+                a = create_search(
+                    self.window.renderer.board,
+                    mode=self.references['algorithm_mode'].get()
+                )
+            except Exception as e:
+                messagebox.showerror('Invalid mode', str(e))
+                return
 
             nonogram = None
             if isinstance(a.problem, NonogramProblem):
@@ -197,7 +201,7 @@ class MainController(object):
             last_node = None
             for step in a.agenda_loop():
                 i += 1
-                last_node = step['path'][0]
+                last_node = step['node']
                 self.timers.append(
                     self.window.parent.after(
                         i * update_interval,
@@ -243,10 +247,14 @@ class MainController(object):
 
             cf = make_func(['x', 'y'], self.references['constraint_formula'].get())
             vc_problem = VCProblem(n, e, cf=cf)
-            solver = AStar(
-                problem=vc_problem,
-                mode=self.references['algorithm_mode'].get()
-            )
+            try:
+                solver = create_search(
+                    vc_problem,
+                    mode=self.references['algorithm_mode'].get()
+                )
+            except Exception as e:
+                messagebox.showerror('Invalid mode', str(e))
+                return
 
             t = time.time()
 
@@ -255,7 +263,7 @@ class MainController(object):
             for step in solver.agenda_loop():
                 i += 1
                 p = step['path']
-                last_node = p[0]
+                last_node = step['node']
                 oss = len(step['open_set'])
                 css = len(step['closed_set'])
 
@@ -1,15 +1,25 @@
 # -*- coding: utf-8 -*-
 
 
+from collections import deque
+from collections.abc import Mapping
 from common import *
+import heapq
+import itertools
+
+# Number of derived layers a DomainMap can have before it is flattened
+DOMAIN_MAP_DEPTH = 8
 
 
 class Node(object):
     """
     Basic Node object that keeps the foundational properties of a Node
-    that might be used in some sort of state or graph representation
+    that might be used in some sort of state or graph representation.
+    Uses slots instead of an instance dict, and only creates the children set when it is first used
     """
 
+    __slots__ = ('index', 'x', 'y', 'parent', '_children', '__weakref__')
+
     def __init__(self, index=None, x=None, y=None):
         """
         Constructor
@@ -19,7 +29,21 @@ class Node(object):
         self.x = x
         self.y = y
         self.parent = None
-        self.children = set()
+        self._children = None
+
+    @property
+    def children(self):
+        """
+        The set of child nodes, created on first access
+        """
+
+        if self._children is None:
+            self._children = set()
+        return self._children
+
+    @children.setter
+    def children(self, children):
+        self._children = children
 
     def __str__(self):
         return 'N' + str(self.index)
@@ -88,11 +112,97 @@ class Graph(object):
             return node_cache.values(), edge_set
 
 
+class DomainMap(Mapping):
+    """
+    Persistent mapping from node to domain, for the states of a GAC problem. A map derived from another one only holds
+    the domains that were written to it, and reads fall through to the map it was derived from, so a child state
+    shares every unchanged domain with its parent and deriving it costs nothing. Once the chain of maps gets longer
+    than DOMAIN_MAP_DEPTH, the next map derived is flattened into a full copy, which bounds the cost of a read.
+
+    Writes go to the newest layer only. A map must not be written to once other maps have been derived from it, and
+    domains are replaced instead of changed in place, since they are shared
+    :param own: The domains held by this layer, every domain for a map that is not derived
+    :param base: The map this one is derived from, None for a full map
+    """
+
+    __slots__ = ('own', 'base', 'root', 'depth', 'total')
+
+    def __init__(self, own=None, base=None):
+        """
+        Constructor
+        """
+
+        self.own = own if own is not None else {}
+        self.base = base
+        self.root = base.root if base is not None else self
+        self.depth = base.depth + 1 if base is not None else 0
+        self.total = base.total if base is not None else sum(len(domain) for domain in self.own.values())
+
+    def derive(self):
+        """
+        Returns an empty layer on top of this map, or a flattened copy if the chain is too long
+        """
+
+        if self.depth >= DOMAIN_MAP_DEPTH:
+            return DomainMap(dict(self.flatten()))
+        return DomainMap(base=self)
+
+    def flatten(self):
+        """
+        Returns a dict with every domain of the map. The dict of a map that is not derived is returned as is,
+        and must not be changed
+        """
+
+        if self.base is None:
+            return self.own
+
+        layers = []
+        layer = self
+        while layer is not None:
+            layers.append(layer.own)
+            layer = layer.base
+
+        nodes = dict(layers.pop())
+        while layers:
+            nodes.update(layers.pop())
+        return nodes
+
+    def __getitem__(self, node):
+        layer = self
+        while layer is not None:
+            if node in layer.own:
+                return layer.own[node]
+            layer = layer.base
+        raise KeyError(node)
+
+    def __setitem__(self, node, domain):
+        self.total += len(domain) - len(self[node])
+        self.own[node] = domain
+
+    def __contains__(self, node):
+        return node in self.root.own
+
+    def __iter__(self):
+        return iter(self.root.own)
+
+    def __len__(self):
+        return len(self.root.own)
+
+    def items(self):
+        return self.flatten().items()
+
+    def values(self):
+        return self.flatten().values()
+
+
 class CSPState(object):
     """
     This class represent a state in a GAC problem, and contains
     only the current domain sets for all the nodes in the problem.
 
+    The domains are kept in a persistent DomainMap, so a child state derived from its parent shares the domains
+    that did not change, and only the domains the propagation replaces take up memory of their own.
+
     A contradiction flag can be set during iteration
     """
 
@@ -101,9 +211,101 @@ class CSPState(object):
         Constructor, takes in dict mapping from node to domain set
         """
 
-        self.nodes = nodes
+        self.nodes = nodes if isinstance(nodes, DomainMap) else DomainMap(dict(nodes))
+        self.contradiction = False
+
+    def derive(self):
+        """
+        Returns a child state sharing every domain with this one, to be filtered further
+        """
+
+        return CSPState(self.nodes.derive())
+
+    def domain_size_total(self):
+        """
+        Returns the sum of the sizes of every domain, kept up to date by the DomainMap
+        """
+
+        return self.nodes.total
+
+
+class BitsetDomains(Mapping):
+    """
+    Read-only mapping view of the domains of a BitsetCSPState, decoding a domain into a set of values when it is read
+    """
+
+    def __init__(self, state):
+        self.state = state
+
+    def __getitem__(self, node):
+        mask = self.state.masks[self.state.index[node]]
+        return {value for value in range(mask.bit_length()) if mask >> value & 1}
+
+    def __iter__(self):
+        return iter(self.state.index)
+
+    def __len__(self):
+        return len(self.state.index)
+
+
+class BitsetCSPState(object):
+    """
+    A state in a GAC problem whose values are small non-negative integers, like the colors of a graph coloring
+    problem. Every domain is an integer bitmask with bit v set if v is in the domain, and the masks are kept in a
+    flat list in node order, so copying a state only copies one list of integers. The node to position index is
+    shared by every state of a problem.
+
+    The nodes attribute decodes the masks on demand, so code reading domains as sets keeps working. Like a DomainMap,
+    the state keeps the sum of its domain sizes in total, and code clearing bits in the masks must update it
+    :param index: Mapping from node to its position in the masks
+    :param masks: The domain bitmask of every node
+    :param total: The sum of the domain sizes, counted from the masks if not provided
+    """
+
+    def __init__(self, index, masks, total=None):
+        """
+        Constructor
+        """
+
+        self.index = index
+        self.masks = masks
+        self.total = total if total is not None else sum(mask.bit_count() for mask in masks)
         self.contradiction = False
 
+    @classmethod
+    def from_domains(cls, nodes):
+        """
+        Encodes a dict mapping from node to domain set
+        :param nodes: The domains, with small non-negative integer values
+        :return: A BitsetCSPState
+        """
+
+        index = {node: i for i, node in enumerate(nodes)}
+        masks = [sum(1 << value for value in set(domain)) for domain in nodes.values()]
+        return cls(index, masks)
+
+    @property
+    def nodes(self):
+        """
+        The domains as a mapping from node to set of values
+        """
+
+        return BitsetDomains(self)
+
+    def domain_size_total(self):
+        """
+        Returns the sum of the sizes of every domain
+        """
+
+        return self.total
+
+    def copy(self):
+        """
+        Returns a copy of the state sharing the node index
+        """
+
+        return BitsetCSPState(self.index, list(self.masks), self.total)
+
 
 class AStarState(Node):
     """
@@ -111,6 +313,8 @@ class AStarState(Node):
     as well as F, G and H values.
     """
 
+    __slots__ = ('is_start', 'is_goal', 'state', 'arc_cost', 'g', 'h', 'f', 'walkable', 'full_repr_mode')
+
     def __init__(self, index=None, x=None, y=None):
         super(AStarState, self).__init__(index=index, x=x, y=y)
         self.is_start = None
@@ -123,18 +327,400 @@ class AStarState(Node):
         self.walkable = True
         self.full_repr_mode = True
 
-    def __lt__(self, other):
-        if self.f == other.f:
-            return self.h < other.h
-        return self.f < other.f
-
-    def __gt__(self, other):
-        if self.f == other.f:
-            return self.h > other.h
-        return self.f > other.f
+    def reset_search_state(self):
+        """
+        Clears the values a search writes on the node, so it can be searched again
+        """
+        self.parent = None
+        self._children = None
+        self.g = 0
+        self.h = 0
+        self.f = 0
 
     def __repr__(self):
         if self.full_repr_mode:
             return 'A*Node(%d, %d, F: %d, G: %d, H: %d)' % (self.x, self.y, self.f, self.g, self.h)
         else:
             return 'A*Node(%d (%d, %d))' % (self.index, self.x, self.y)
+
+
+class PriorityAgenda(object):
+    """
+    Open set for best-first search. Keeps the nodes in a binary heap ordered by (F, H), next to a hash
+    index mapping every open node to its live heap entry. Membership tests are O(1), and re-adding a node
+    with an improved cost pushes a fresh entry while the old one is lazily discarded when it surfaces.
+
+    Heap entries are (F, H, counter, node) tuples, so ordering is done by plain tuple comparison and never
+    reaches the node. The insertion counter breaks ties between equal F and H values deterministically
+    :param tie_break: 'fifo' to take the oldest of equal nodes first, 'lifo' to take the newest
+    """
+
+    def __init__(self, tie_break='fifo'):
+        """
+        Constructor
+        """
+
+        if tie_break not in ('fifo', 'lifo'):
+            raise Exception('Unknown tie breaking rule: %s' % tie_break)
+
+        self.heap = []
+        self.index = {}
+        self.counter = itertools.count(0, 1 if tie_break == 'fifo' else -1)
+
+    def add(self, node, f, h):
+        """
+        Adds a node to the agenda, or re-prioritizes it if it is already open
+        :param node: The node to add
+        :param f: The F value of the node
+        :param h: The H value of the node, used to break ties between equal F values
+        """
+
+        entry = (f, h, next(self.counter), node)
+        self.index[node] = entry
+        heapq.heappush(self.heap, entry)
+
+        # Rebuild the heap when stale entries start to dominate it
+        if len(self.heap) > 2 * len(self.index) + 64:
+            self.heap = list(self.index.values())
+            heapq.heapify(self.heap)
+
+    def pop(self):
+        """
+        Removes and returns the open node with the lowest (F, H) key
+        :return: The node
+        """
+
+        while self.heap:
+            entry = heapq.heappop(self.heap)
+            node = entry[-1]
+            if self.index.get(node) is entry:
+                del self.index[node]
+                return node
+
+        raise IndexError('pop from an empty agenda')
+
+    def min_priority(self):
+        """
+        Returns the lowest F value in the agenda without removing the node, or None if the agenda is empty
+        """
+
+        key = self.min_key()
+        return key[0] if key is not None else None
+
+    def min_key(self):
+        """
+        Returns the lowest (F, H) key in the agenda without removing the node, or None if the agenda is empty
+        """
+
+        while self.heap:
+            entry = self.heap[0]
+            if self.index.get(entry[-1]) is entry:
+                return entry[0], entry[1]
+            heapq.heappop(self.heap)
+
+        return None
+
+    def discard(self, node):
+        """
+        Removes a node from the agenda if it is open. Its heap entry is skipped when it reaches the top
+        :param node: The node to remove
+        """
+
+        self.index.pop(node, None)
+
+    def __contains__(self, node):
+        return node in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+
+class BucketAgenda(object):
+    """
+    Open set for best-first search when every F and H value is an integer (Dial's algorithm). Nodes are kept in
+    buckets indexed by F, split on H within each bucket, next to the same hash index as the PriorityAgenda.
+    Adding a node is O(1), and taking one only scans forward from the lowest non-empty F bucket, which with a
+    consistent heuristic never moves backwards. It takes the nodes in exactly the same order as the PriorityAgenda.
+
+    Re-adding a node leaves its old bucket entry behind, and the entry is lazily discarded when it surfaces
+    :param tie_break: 'fifo' to take the oldest of equal nodes first, 'lifo' to take the newest
+    """
+
+    def __init__(self, tie_break='fifo'):
+        """
+        Constructor
+        """
+
+        if tie_break not in ('fifo', 'lifo'):
+            raise Exception('Unknown tie breaking rule: %s' % tie_break)
+
+        self.buckets = {}
+        self.index = {}
+        self.lowest = float('inf')
+        self.entries = 0
+        self.lifo = tie_break == 'lifo'
+
+    def add(self, node, f, h):
+        """
+        Adds a node to the agenda, or re-prioritizes it if it is already open
+        :param node: The node to add
+        :param f: The F value of the node, must be an integer
+        :param h: The H value of the node, used to break ties between equal F values
+        """
+
+        if f % 1:
+            raise Exception('The bucket agenda needs integer F values, got %s' % f)
+
+        # A fresh entry per add, so a stale entry is recognized by identity
+        entry = (node,)
+        self.index[node] = entry
+        self.entries += 1
+
+        levels = self.buckets.get(f)
+        if levels is None:
+            levels = self.buckets[f] = {}
+        queue = levels.get(h)
+        if queue is None:
+            queue = levels[h] = deque()
+        queue.append(entry)
+
+        if f < self.lowest:
+            self.lowest = f
+
+        # Rebuild the buckets when stale entries start to dominate them
+        if self.entries > 2 * len(self.index) + 64:
+            self.compact()
+
+    def compact(self):
+        """
+        Drops the stale entries from every bucket
+        """
+
+        for f, levels in list(self.buckets.items()):
+            for h, queue in list(levels.items()):
+                live = deque(entry for entry in queue if self.index.get(entry[0]) is entry)
+                if live:
+                    levels[h] = live
+                else:
+                    del levels[h]
+            if not levels:
+                del self.buckets[f]
+
+        self.entries = len(self.index)
+
+    def top(self):
+        """
+        Finds the live entry with the lowest (F, H) key, discarding the stale entries in front of it
+        :return: The F value, the H value and the queue holding the entry at its taking end, or None if empty
+        """
+
+        if not self.index:
+            return None
+
+        while True:
+            levels = self.buckets.get(self.lowest)
+            if not levels:
+                self.buckets.pop(self.lowest, None)
+                self.lowest += 1
+                continue
+
+            h = min(levels)
+            queue = levels[h]
+            entry = queue[-1] if self.lifo else queue[0]
+            if self.index.get(entry[0]) is entry:
+                return self.lowest, h, queue
+
+            queue.pop() if self.lifo else queue.popleft()
+            self.entries -= 1
+            if not queue:
+                del levels[h]
+
+    def pop(self):
+        """
+        Removes and returns the open node with the lowest (F, H) key
+        :return: The node
+        """
+
+        index = self.index
+        while index:
+            levels = self.buckets.get(self.lowest)
+            if not levels:
+                self.buckets.pop(self.lowest, None)
+                self.lowest += 1
+                continue
+
+            h = min(levels)
+            queue = levels[h]
+            entry = queue.pop() if self.lifo else queue.popleft()
+            self.entries -= 1
+            if not queue:
+                del levels[h]
+
+            node = entry[0]
+            if index.get(node) is entry:
+                del index[node]
+                return node
+
+        raise IndexError('pop from an empty agenda')
+
+    def min_priority(self):
+        """
+        Returns the lowest F value in the agenda without removing the node, or None if the agenda is empty
+        """
+
+        top = self.top()
+        return top[0] if top is not None else None
+
+    def min_key(self):
+        """
+        Returns the lowest (F, H) key in the agenda without removing the node, or None if the agenda is empty
+        """
+
+        top = self.top()
+        return (top[0], top[1]) if top is not None else None
+
+    def discard(self, node):
+        """
+        Removes a node from the agenda if it is open. Its bucket entry is skipped when it surfaces
+        :param node: The node to remove
+        """
+
+        self.index.pop(node, None)
+
+    def __contains__(self, node):
+        return node in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.index)
+
+
+class FifoAgenda(object):
+    """
+    Open set for breadth-first search. Nodes are kept in a deque with a hash index next to it,
+    so both ends and membership tests are O(1). Re-adding an open node leaves it where it is
+    :param tie_break: Ignored, the order of a blind agenda is fixed
+    """
+
+    def __init__(self, tie_break=None):
+        """
+        Constructor
+        """
+
+        self.queue = deque()
+        self.index = set()
+
+    def add(self, node, f=None, h=None):
+        """
+        Adds a node to the back of the agenda, unless it is already open
+        :param node: The node to add
+        :param f: Ignored, the blind agendas are not ordered by cost
+        :param h: Ignored, the blind agendas are not ordered by cost
+        """
+
+        if node not in self.index:
+            self.index.add(node)
+            self.queue.append(node)
+
+    def pop(self):
+        """
+        Removes and returns the oldest node in the agenda
+        :return: The node
+        """
+
+        node = self.queue.popleft()
+        self.index.discard(node)
+        return node
+
+    def __contains__(self, node):
+        return node in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def __iter__(self):
+        return iter(self.queue)
+
+
+class LifoAgenda(FifoAgenda):
+    """
+    Open set for depth-first search. Same as the FifoAgenda, but nodes are taken from the back
+    """
+
+    def pop(self):
+        """
+        Removes and returns the newest node in the agenda
+        :return: The node
+        """
+
+        node = self.queue.pop()
+        self.index.discard(node)
+        return node
+
+
+class SearchStep(dict):
+    """
+    A single step on the step stream of a search. Carries what changed in the step, while the full path is only
+    reconstructed, and cached, the first time the 'path' key is read
+    """
+
+    def __init__(self, path_of, **kwargs):
+        """
+        Constructor
+        :param path_of: Function returning the path from a node back to the start node
+        :param kwargs: The contents of the step, must contain the expanded 'node'
+        """
+
+        super(SearchStep, self).__init__(**kwargs)
+        self.path_of = path_of
+
+    def __missing__(self, key):
+        if key != 'path':
+            raise KeyError(key)
+
+        path = self.path_of(self['node'])
+        self['path'] = path
+        return path
+
+
+class UnionView(object):
+    """
+    Read-only view over several sets or agendas, for reporting the combined open or closed sets of searches
+    that keep more than one of them
+    """
+
+    def __init__(self, *parts):
+        self.parts = parts
+
+    def __contains__(self, node):
+        return any(node in part for part in self.parts)
+
+    def __len__(self):
+        return sum(len(part) for part in self.parts)
+
+    def __iter__(self):
+        return itertools.chain(*self.parts)
+
+
+class FrontierView(object):
+    """
+    Read-only view over the nodes that are still pending on a depth-first search stack.
+    Every frame on the stack ends with a deque of (node, g, h) entries that are yet to be visited
+    """
+
+    def __init__(self, stack):
+        self.stack = stack
+
+    def __contains__(self, node):
+        return any(node is entry[0] for entry in self)
+
+    def __len__(self):
+        return sum(len(frame[-1]) for frame in self.stack)
+
+    def __iter__(self):
+        return (entry[0] for frame in self.stack for entry in frame[-1])
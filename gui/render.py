@@ -122,6 +122,10 @@ class CanvasRenderer(AbstractRenderer):
                     fill_color = '#4040FF'
                 elif node.is_goal:
                     fill_color = '#40FF40'
+                elif node.arc_cost > 1:
+                    # Terrain gets darker the more it costs to leave, but never as dark as an obstacle
+                    shade = max(96, 255 - 32 * (node.arc_cost - 1))
+                    fill_color = self.rgb_to_color(shade, shade, shade)
 
                 self.canvas.create_rectangle(
                     *coords,
@@ -0,0 +1,323 @@
+# -*- coding: utf8 -*-
+
+import hashlib
+import heapq
+import json
+from array import array
+
+from common import *
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Number of landmarks picked per board
+LANDMARK_COUNT = 8
+# Directory next to the boards where landmark tables are persisted
+LANDMARK_DIR = '.landmarks'
+# Bumped whenever the persisted layout changes, so stale tables are rebuilt
+LANDMARK_FORMAT = 1
+# Number of distance fields a board keeps cached
+DISTANCE_FIELD_CACHE = 16
+
+
+def board_size(problem):
+    """
+    Returns the width and height of the board of a NavigationProblem
+    """
+    return problem.width, problem.height
+
+
+def flood(problem, source, reverse=False):
+    """
+    Dijkstra flood over the whole board
+    :param problem: The NavigationProblem to flood
+    :param source: The (x, y) to flood from
+    :param reverse: Follow the arcs in reverse, giving the distance from every cell to the source instead
+    :return: An array of distances indexed by y * width + x, infinite for cells that cannot be reached
+    """
+    width, height = board_size(problem)
+    walkable = problem.is_walkable
+    cost = [problem.arc_cost_at(x, y) for y in range(height) for x in range(width)]
+
+    distances = array('d', [float('inf')]) * (width * height)
+    start = source[1] * width + source[0]
+    distances[start] = 0
+    heap = [(0, start)]
+
+    while heap:
+        distance, cell = heapq.heappop(heap)
+        if distance > distances[cell]:
+            continue
+
+        y, x = divmod(cell, width)
+        for nx, ny in ((x + 1, y), (x, y - 1), (x - 1, y), (x, y + 1)):
+            if walkable(nx, ny):
+                neighbour = ny * width + nx
+                d = distance + (cost[neighbour] if reverse else cost[cell])
+                if d < distances[neighbour]:
+                    distances[neighbour] = d
+                    heapq.heappush(heap, (d, neighbour))
+
+    return distances
+
+
+def walkable_mask(problem):
+    """
+    Returns the walkable flags of a board as a height by width NumPy array
+    """
+    width, height = board_size(problem)
+    if isinstance(getattr(problem, 'walkable', None), bytearray):
+        return numpy.frombuffer(bytes(problem.walkable), dtype=numpy.uint8).reshape(height, width) == 1
+
+    return numpy.array([[problem.is_walkable(x, y) for x in range(width)] for y in range(height)], dtype=bool)
+
+
+def wavefront(problem, source, cost):
+    """
+    Breadth-first flood of a board where every arc has the same cost, advancing the whole frontier at once with
+    NumPy array shifts instead of one cell at a time
+    :param problem: The NavigationProblem to flood
+    :param source: The (x, y) to flood from
+    :param cost: The cost of every arc
+    :return: An array of distances indexed by y * width + x, infinite for cells that cannot be reached
+    """
+    walkable = walkable_mask(problem)
+    distances = numpy.full(walkable.shape, float('inf'))
+    frontier = numpy.zeros(walkable.shape, dtype=bool)
+    frontier[source[1], source[0]] = walkable[source[1], source[0]]
+    visited = frontier.copy()
+    step = 0
+
+    while frontier.any():
+        distances[frontier] = step * cost
+        reached = numpy.zeros(walkable.shape, dtype=bool)
+        reached[1:, :] |= frontier[:-1, :]
+        reached[:-1, :] |= frontier[1:, :]
+        reached[:, 1:] |= frontier[:, :-1]
+        reached[:, :-1] |= frontier[:, 1:]
+        frontier = reached & walkable & ~visited
+        visited |= frontier
+        step += 1
+
+    field = array('d')
+    field.frombytes(distances.tobytes())
+    return field
+
+
+def distance_field(problem, source, reverse=False):
+    """
+    Distances between one cell and every other cell of a board. Uses the NumPy wavefront when NumPy is installed
+    and every arc costs the same, and the Dijkstra flood otherwise
+    :param problem: The NavigationProblem to flood
+    :param source: The (x, y) to measure from
+    :param reverse: Measure the distance from every cell to the source instead
+    :return: An array of distances indexed by y * width + x, infinite for cells that cannot be reached
+    """
+    if numpy is not None and problem.has_uniform_costs():
+        return wavefront(problem, source, problem.arc_cost_at(*source))
+    return flood(problem, source, reverse=reverse)
+
+
+def distance_matrix(problem, points):
+    """
+    Distances between every pair of a set of cells, with one distance field per cell
+    :param problem: The NavigationProblem to measure on
+    :param points: A list of (x, y) cells
+    :return: A list of rows, where row i holds the distances from points[i] to every point
+    """
+    width = board_size(problem)[0]
+    matrix = []
+    for point in points:
+        field = problem.get_distance_field(point)
+        matrix.append([field[y * width + x] for x, y in points])
+
+    return matrix
+
+
+def has_uniform_costs(problem):
+    """
+    Returns whether every walkable cell of a board has the same arc cost, so distances are symmetric
+    """
+    width, height = board_size(problem)
+    return len({
+        problem.arc_cost_at(x, y) for y in range(height) for x in range(width) if problem.is_walkable(x, y)
+    }) <= 1
+
+
+def has_integer_costs(problem):
+    """
+    Returns whether every walkable cell of a board has a whole number arc cost
+    """
+    width, height = board_size(problem)
+    return all(
+        float(problem.arc_cost_at(x, y)).is_integer()
+        for y in range(height) for x in range(width) if problem.is_walkable(x, y)
+    )
+
+
+class LandmarkTable(object):
+    """
+    Exact distances from and to a handful of landmark cells, for the ALT (A*, landmarks, triangle inequality)
+    heuristic. For any landmark L, d(n, g) >= d(L, g) - d(L, n) and d(n, g) >= d(n, L) - d(g, L), and the best of
+    these bounds is an admissible and consistent estimate that, unlike the straight line distances, sees obstacles.
+    :param width: Width of the board
+    :param height: Height of the board
+    :param landmarks: The (x, y) of every landmark
+    :param sources: Per landmark, the distance from the landmark to every cell
+    :param targets: Per landmark, the distance from every cell to the landmark
+    """
+
+    def __init__(self, width, height, landmarks, sources, targets):
+        self.width = width
+        self.height = height
+        self.landmarks = landmarks
+        self.sources = sources
+        self.targets = targets
+
+    @classmethod
+    def build(cls, problem, count=LANDMARK_COUNT):
+        """
+        Picks landmarks by farthest point selection, starting with the cell farthest from the start node,
+        then repeatedly the reachable cell farthest from every landmark picked so far
+        :param problem: The NavigationProblem to build the table for
+        :param count: The number of landmarks
+        :return: A LandmarkTable
+        """
+        width, height = board_size(problem)
+        symmetric = problem.has_uniform_costs()
+
+        start = problem.get_start_node()
+        closest = distance_field(problem, (start.x, start.y))
+        landmarks, sources, targets = [], [], []
+
+        for i in range(count):
+            reachable = [(d, cell) for cell, d in enumerate(closest) if d != float('inf')]
+            if not reachable:
+                break
+            distance, cell = max(reachable)
+            if distance == 0 and landmarks:
+                break
+
+            y, x = divmod(cell, width)
+            landmarks.append((x, y))
+            sources.append(distance_field(problem, (x, y)))
+            targets.append(sources[-1] if symmetric else distance_field(problem, (x, y), reverse=True))
+            closest = array('d', map(min, closest, sources[-1])) if i else sources[-1]
+
+        log('Built %d landmarks for a %dx%d board' % (len(landmarks), width, height))
+        return cls(width, height, landmarks, sources, targets)
+
+    def estimate(self, x, y, tx, ty):
+        """
+        Lower bound on the distance between two cells
+        :param x: X coordinate to estimate from
+        :param y: Y coordinate to estimate from
+        :param tx: X coordinate to estimate to
+        :param ty: Y coordinate to estimate to
+        :return: The largest bound over all landmarks, 0 if none of them apply
+        """
+        cell = y * self.width + x
+        target = ty * self.width + tx
+        inf = float('inf')
+        best = 0
+
+        for source, to_landmark in zip(self.sources, self.targets):
+            if source[cell] != inf and source[target] != inf:
+                best = max(best, source[target] - source[cell])
+            if to_landmark[cell] != inf and to_landmark[target] != inf:
+                best = max(best, to_landmark[cell] - to_landmark[target])
+
+        return best
+
+    def save(self, path, signature):
+        """
+        Writes the table to a file, as a JSON header line followed by the raw distance arrays
+        :param path: The file to write
+        :param signature: Identifies the board the table was built for
+        """
+        symmetric = all(source is target for source, target in zip(self.sources, self.targets))
+        header = {
+            'format': LANDMARK_FORMAT,
+            'signature': signature,
+            'width': self.width,
+            'height': self.height,
+            'landmarks': self.landmarks,
+            'symmetric': symmetric
+        }
+
+        with open(path, 'wb') as f:
+            f.write(json.dumps(header).encode('utf8') + b'\n')
+            for source, target in zip(self.sources, self.targets):
+                source.tofile(f)
+                if not symmetric:
+                    target.tofile(f)
+
+    @classmethod
+    def load(cls, path, signature):
+        """
+        Reads a table written by save
+        :param path: The file to read
+        :param signature: The signature the table must have been saved with
+        :return: A LandmarkTable, or None if the file is from another board or format
+        """
+        with open(path, 'rb') as f:
+            header = json.loads(f.readline().decode('utf8'))
+            if header.get('format') != LANDMARK_FORMAT or header.get('signature') != signature:
+                return None
+
+            size = header['width'] * header['height']
+            sources, targets = [], []
+            for i in range(len(header['landmarks'])):
+                sources.append(array('d'))
+                sources[-1].fromfile(f, size)
+                if header['symmetric']:
+                    targets.append(sources[-1])
+                else:
+                    targets.append(array('d'))
+                    targets[-1].fromfile(f, size)
+
+        landmarks = [tuple(landmark) for landmark in header['landmarks']]
+        return cls(header['width'], header['height'], landmarks, sources, targets)
+
+
+def landmark_path(board_path):
+    """
+    Returns where the landmark table of a board file is persisted
+    """
+    return os.path.join(os.path.dirname(os.path.abspath(board_path)), LANDMARK_DIR,
+                        os.path.basename(board_path) + '.landmarks')
+
+
+def load_landmarks(problem, count=LANDMARK_COUNT):
+    """
+    Loads the persisted landmark table of a board, or builds and persists it if it is missing or outdated
+    :param problem: The NavigationProblem to get the table for
+    :param count: The number of landmarks
+    :return: A LandmarkTable
+    """
+    if not problem.board_path:
+        return LandmarkTable.build(problem, count=count)
+
+    with open(problem.board_path, 'rb') as f:
+        signature = '%s:%d' % (hashlib.sha1(f.read()).hexdigest(), count)
+
+    path = landmark_path(problem.board_path)
+    if os.path.isfile(path):
+        try:
+            table = LandmarkTable.load(path, signature)
+            if table is not None:
+                debug('Loaded landmarks from %s' % path)
+                return table
+        except (OSError, ValueError, EOFError) as e:
+            log('Could not read landmarks from %s: %s' % (path, e))
+
+    table = LandmarkTable.build(problem, count=count)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        table.save(path, signature)
+    except OSError as e:
+        log('Could not persist landmarks to %s: %s' % (path, e))
+
+    return table
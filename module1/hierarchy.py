@@ -0,0 +1,227 @@
+# -*- coding: utf8 -*-
+
+import heapq
+
+from common import *
+
+# Side length of the square clusters the board is partitioned into
+HPA_CLUSTER_SIZE = 10
+# Entrances at least this wide get a transition at both ends instead of a single one in the middle
+HPA_ENTRANCE_WIDTH = 6
+
+
+class ClusterAbstraction(object):
+    """
+    Abstract graph for hierarchical pathfinding (HPA*) on a NavigationProblem. The board is partitioned into square
+    clusters, and every open stretch along the border between two clusters gets one or two transitions. The cells
+    on both sides of a transition become abstract nodes, connected by the arc across the border and by the shortest
+    path inside the cluster to every other abstract node of the same cluster.
+    The abstract graph is built once per board. A query only connects its start and goal to the abstract nodes of
+    their own clusters, and the abstract path found by A* is refined back into cells one cluster at a time.
+    Paths are optimal within the abstraction, which is usually close to, but not always, the optimal board path.
+    Abstract nodes are kept as (x, y) coordinates, so the abstraction works for compact boards as well
+    :param problem: The NavigationProblem to abstract
+    :param cluster_size: Side length of the clusters
+    """
+
+    def __init__(self, problem, cluster_size=HPA_CLUSTER_SIZE):
+        """
+        Builds the abstract graph
+        """
+
+        self.problem = problem
+        self.cluster_size = cluster_size
+        self.width = len(problem.get_grid()[0])
+        self.height = len(problem.get_grid())
+
+        # Abstract node -> {abstract node: cost}, for the arcs that do not depend on the query
+        self.edges = {}
+        # Cluster -> set of abstract nodes inside it
+        self.entrances = {}
+
+        self.query = None
+        self.query_edges = {}
+
+        self.build_transitions()
+        self.build_intra_edges()
+
+        log('Built cluster abstraction with %d abstract nodes in %d clusters' % (
+            len(self.edges), len(self.entrances)))
+
+    def cluster_of(self, cell):
+        """
+        Returns the (column, row) of the cluster a cell is in
+        """
+        return cell[0] // self.cluster_size, cell[1] // self.cluster_size
+
+    def bounds(self, cluster):
+        """
+        Returns the x0, y0, x1, y1 bounds of a cluster, exclusive at the end
+        """
+        x0 = cluster[0] * self.cluster_size
+        y0 = cluster[1] * self.cluster_size
+        return x0, y0, min(x0 + self.cluster_size, self.width), min(y0 + self.cluster_size, self.height)
+
+    def cost(self, cell):
+        """
+        Returns the cost of leaving a cell
+        """
+        return self.problem.arc_cost_at(*cell)
+
+    def build_transitions(self):
+        """
+        Finds the open stretches along every border between two clusters, and adds their transitions
+        """
+        size = self.cluster_size
+
+        for x in range(size - 1, self.width - 1, size):
+            self.add_entrances([((x, y), (x + 1, y)) for y in range(self.height)])
+        for y in range(size - 1, self.height - 1, size):
+            self.add_entrances([((x, y), (x, y + 1)) for x in range(self.width)])
+
+    def add_entrances(self, border):
+        """
+        Splits a border into entrances at the cluster corners and wherever either side is blocked
+        :param border: A list of (cell, cell across the border) pairs along the border
+        """
+        walkable = self.problem.is_walkable
+        entrances = []
+
+        for a, b in border:
+            if not (walkable(*a) and walkable(*b)):
+                entrances.append([])
+            elif not entrances or not entrances[-1] or self.cluster_of(a) != self.cluster_of(entrances[-1][-1][0]):
+                entrances.append([(a, b)])
+            else:
+                entrances[-1].append((a, b))
+
+        for entrance in entrances:
+            if not entrance:
+                continue
+            if len(entrance) < HPA_ENTRANCE_WIDTH:
+                self.add_transition(*entrance[len(entrance) // 2])
+            else:
+                self.add_transition(*entrance[0])
+                self.add_transition(*entrance[-1])
+
+    def add_transition(self, a, b):
+        """
+        Adds the cells on both sides of a transition as abstract nodes, connected across the border
+        """
+        for cell in (a, b):
+            self.edges.setdefault(cell, {})
+            self.entrances.setdefault(self.cluster_of(cell), set()).add(cell)
+
+        self.edges[a][b] = self.cost(a)
+        self.edges[b][a] = self.cost(b)
+
+    def build_intra_edges(self):
+        """
+        Connects the abstract nodes of every cluster by their shortest paths inside the cluster
+        """
+        for cluster, entrances in self.entrances.items():
+            for entrance in entrances:
+                distances = self.search_cluster(entrance, entrances)[0]
+                for target in entrances:
+                    if target != entrance and target in distances:
+                        self.edges[entrance][target] = distances[target]
+
+    def neighbours(self, cell, bounds):
+        """
+        Returns the walkable cells adjacent to a cell inside the given bounds
+        """
+        x, y = cell
+        x0, y0, x1, y1 = bounds
+        walkable = self.problem.is_walkable
+
+        return [
+            (nx, ny) for nx, ny in ((x + 1, y), (x, y - 1), (x - 1, y), (x, y + 1))
+            if x0 <= nx < x1 and y0 <= ny < y1 and walkable(nx, ny)
+        ]
+
+    def search_cluster(self, source, targets, reverse=False):
+        """
+        Dijkstra search from a cell, restricted to its cluster. Stops when every target is settled
+        :param source: The cell to search from
+        :param targets: The cells to find the distances to
+        :param reverse: Search along the arcs in reverse, giving the distances from the targets to the source
+        :return: The distances and the parents of the settled cells
+        """
+        bounds = self.bounds(self.cluster_of(source))
+        distances = {source: 0}
+        parents = {source: None}
+        remaining = set(targets) - {source}
+        settled = set()
+        heap = [(0, source)]
+
+        while heap and remaining:
+            distance, cell = heapq.heappop(heap)
+            if cell in settled:
+                continue
+            settled.add(cell)
+            remaining.discard(cell)
+
+            for neighbour in self.neighbours(cell, bounds):
+                cost = distance + self.cost(neighbour if reverse else cell)
+                if cost < distances.get(neighbour, float('inf')):
+                    distances[neighbour] = cost
+                    parents[neighbour] = cell
+                    heapq.heappush(heap, (cost, neighbour))
+
+        return {cell: distances[cell] for cell in settled}, parents
+
+    def connect(self, start, goal):
+        """
+        Connects the start and goal of a query to the abstract nodes of their clusters.
+        The connections of the previous query are dropped
+        :param start: The (x, y) of the start cell
+        :param goal: The (x, y) of the goal cell
+        """
+        if self.query == (start, goal):
+            return
+
+        self.query = (start, goal)
+        self.query_edges = {start: {}}
+
+        start_entrances = self.entrances.get(self.cluster_of(start), set())
+        goal_entrances = self.entrances.get(self.cluster_of(goal), set())
+
+        targets = set(start_entrances)
+        if self.cluster_of(start) == self.cluster_of(goal):
+            targets.add(goal)
+        for cell, distance in self.search_cluster(start, targets)[0].items():
+            if cell in targets and cell != start:
+                self.query_edges[start][cell] = distance
+
+        for cell, distance in self.search_cluster(goal, goal_entrances, reverse=True)[0].items():
+            if cell in goal_entrances and cell != goal:
+                self.query_edges.setdefault(cell, {})[goal] = distance
+
+    def successors(self, cell):
+        """
+        Returns the abstract successors of a cell for the current query
+        :param cell: The (x, y) of an abstract node, or of the start of the query
+        :return: A list of ((x, y), cost) tuples
+        """
+        successors = dict(self.edges.get(cell, {}))
+        for target, cost in self.query_edges.get(cell, {}).items():
+            successors[target] = min(cost, successors.get(target, float('inf')))
+
+        return list(successors.items())
+
+    def refine(self, a, b):
+        """
+        Returns the cells of the board path behind an abstract arc
+        :param a: The cell the arc starts in
+        :param b: The cell the arc ends in
+        :return: The cells from a to b
+        """
+        if self.cluster_of(a) != self.cluster_of(b):
+            return [a, b]
+
+        parents = self.search_cluster(a, [b])[1]
+        cells = [b]
+        while cells[-1] != a:
+            cells.append(parents[cells[-1]])
+
+        return cells[::-1]
@@ -2,9 +2,48 @@
 #
 # Created by 'hakloev' on 9/10/15
 
-from algorithms import AStarProblem
-from datastructures import AStarState
+from array import array
+from collections import OrderedDict
 from math import pow, sqrt
+from weakref import WeakValueDictionary
+
+from algorithms import AStarProblem, create_agenda
+from common import *
+from datastructures import AStarState, SearchStep
+from module1.distances import LandmarkTable, load_landmarks, distance_field, distance_matrix, has_uniform_costs, \
+    has_integer_costs, DISTANCE_FIELD_CACHE
+from module1.hierarchy import ClusterAbstraction, HPA_CLUSTER_SIZE
+
+# The A* modes the GridAStar engine can run in
+GRID_ASTAR_MODES = ['best', 'bfs', 'dfs']
+
+
+def read_board(board_path):
+    """
+    Parses a board file
+    :param board_path: Path to the board file. After the size and the start and goal lines, every line is either an
+    obstacle, x y w h, or a stretch of terrain that costs more to leave, x y w h cost
+    :return: The width, height, start (x, y), goal (x, y), a list of (x, y, width, height) obstacles
+    and a list of (x, y, width, height, cost) terrain stretches
+    """
+    obstacles = []
+    terrain = []
+
+    with open(board_path) as f:
+        width, height = map(int, f.readline().split())
+        sx, sy, gx, gy = map(int, f.readline().split())
+        for line in f:
+            values = tuple(map(int, line.split()))
+            if len(values) == 4:
+                obstacles.append(values)
+            elif len(values) == 5:
+                if values[4] < 1:
+                    raise Exception('Terrain costs must be at least 1, got %d' % values[4])
+                terrain.append(values)
+            elif values:
+                raise Exception('Malformed board line: %s' % line.strip())
+
+    return width, height, (sx, sy), (gx, gy), obstacles, terrain
 
 
 class NavigationProblem(AStarProblem):
@@ -23,6 +62,14 @@ class NavigationProblem(AStarProblem):
         self.grid = None
         self.start_node = None
         self.goal_node = None
+        self.width = 0
+        self.height = 0
+        self.abstraction = None
+        self.landmarks = None
+        self.distance_fields = OrderedDict()
+        self.uniform_costs = None
+        self.integer_costs = None
+        self.modified = False
 
         if board_path:
             self.init_grid_from_file()
@@ -33,21 +80,69 @@ class NavigationProblem(AStarProblem):
         """
         Reads and parses all the data from the text file representing the board
         """
-        with open(self.board_path) as f:
-            width, height = map(int, f.readline().split())
-            self.grid = [[AStarState(index=(y*x+x), x=x, y=y) for x in range(width)] for y in range(height)]
-            sx, sy, gx, gy = map(int, f.readline().split())
-            self.start_node = self.get_node(sx, sy)
-            self.start_node.is_start = True
-            self.goal_node = self.get_node(gx, gy)
-            self.goal_node.is_goal = True
-
-            for line in f.readlines():
-                ox, oy, ow, oh = map(int, line.split())
-                for y in range(oh):
-                    for x in range(ow):
-                        obstacle_node = self.get_node(ox + x, oy + y)
-                        obstacle_node.walkable = False
+        width, height, (sx, sy), (gx, gy), obstacles, terrain = read_board(self.board_path)
+        self.width = width
+        self.height = height
+        self.grid = [[AStarState(index=(y*x+x), x=x, y=y) for x in range(width)] for y in range(height)]
+        self.start_node = self.get_node(sx, sy)
+        self.start_node.is_start = True
+        self.goal_node = self.get_node(gx, gy)
+        self.goal_node.is_goal = True
+
+        for ox, oy, ow, oh in obstacles:
+            for y in range(oh):
+                for x in range(ow):
+                    obstacle_node = self.get_node(ox + x, oy + y)
+                    obstacle_node.walkable = False
+
+        for tx, ty, tw, th, cost in terrain:
+            for y in range(th):
+                for x in range(tw):
+                    self.get_node(tx + x, ty + y).arc_cost = cost
+
+    def set_query(self, start, goal, touched=()):
+        """
+        Moves the start and goal of the board, so a board that is loaded once can answer many queries.
+        The values a previous search wrote on the nodes it touched are cleared, the rest of the board is left alone
+        :param start: The (x, y) of the new start
+        :param goal: The (x, y) of the new goal
+        :param touched: The nodes a previous search may have written to
+        """
+        for x, y in (start, goal):
+            if not (0 <= x < len(self.grid[0]) and 0 <= y < len(self.grid)):
+                raise Exception('Query coordinates (%d, %d) are outside the board' % (x, y))
+
+        for node in touched:
+            node.reset_search_state()
+
+        self.start_node.is_start = None
+        self.goal_node.is_goal = None
+        self.start_node = self.get_node(*start)
+        self.goal_node = self.get_node(*goal)
+        self.start_node.reset_search_state()
+        self.start_node.is_start = True
+        self.goal_node.is_goal = True
+
+    def set_walkable(self, x, y, walkable):
+        """
+        Blocks or clears a cell of the loaded board. Everything precomputed from the obstacles is dropped,
+        and landmarks are rebuilt in memory instead of being read from the board file
+        :param x: X coordinate
+        :param y: Y coordinate
+        :param walkable: Whether the cell can be entered
+        :return: The node of the cell, to pass on to incremental searches
+        """
+        node = self.get_node(x, y)
+        node.walkable = walkable
+
+        self.modified = True
+        self.abstraction = None
+        self.landmarks = None
+        self.distance_fields.clear()
+        self.uniform_costs = None
+        self.integer_costs = None
+
+        return node
 
     def get_all_successor_nodes(self, node):
         """
@@ -66,17 +161,228 @@ class NavigationProblem(AStarProblem):
 
         return nodes
 
+    def is_walkable(self, x, y):
+        """
+        Returns whether the given coordinates are inside the board and not an obstacle
+        :param x: X coordinate
+        :param y: Y coordinate
+        """
+        return 0 <= x < len(self.grid[0]) and 0 <= y < len(self.grid) and self.get_node(x, y).walkable
+
+    def get_jump_point_successors(self, node, parent):
+        """
+        Jump point search (4-connected) successor function. Prunes the neighbours of the node based on the direction
+        it was reached from, and jumps along each remaining direction until a jump point or the goal is found.
+        Only valid on boards where every arc has the same cost
+        :param node: The node to expand
+        :param parent: The jump point the node was reached from, None for the start node
+        :return: A list of (jump point, cost of the jump) tuples
+        """
+        x, y = node.x, node.y
+
+        if parent is None:
+            directions = [(1, 0), (0, -1), (-1, 0), (0, 1)]
+        else:
+            dx = (x > parent.x) - (x < parent.x)
+            dy = (y > parent.y) - (y < parent.y)
+            if dx:
+                directions = [(dx, 0), (0, -1), (0, 1)]
+            else:
+                directions = [(0, dy), (1, 0), (-1, 0)]
+
+        cost = self.arc_cost(node)
+        successors = []
+        for dx, dy in directions:
+            jump_point = self.jump(x + dx, y + dy, dx, dy)
+            if jump_point is not None:
+                jx, jy = jump_point
+                successors.append((self.get_node(jx, jy), cost * (abs(jx - x) + abs(jy - y))))
+
+        return successors
+
+    def jump(self, x, y, dx, dy):
+        """
+        Moves from the given coordinates in a straight line until a jump point is found.
+        A cell is a jump point if it is the goal, if it has a forced neighbour, or, when moving vertically,
+        if a horizontal jump from it would find a jump point
+        :param x: X coordinate to start from
+        :param y: Y coordinate to start from
+        :param dx: Horizontal direction, -1, 0 or 1
+        :param dy: Vertical direction, -1, 0 or 1
+        :return: The (x, y) coordinates of the jump point, or None if the jump hits a wall
+        """
+        goal = self.get_goal_node()
+        walkable = self.is_walkable
+
+        while walkable(x, y):
+            if x == goal.x and y == goal.y:
+                return x, y
+
+            if dx:
+                if (walkable(x, y - 1) and not walkable(x - dx, y - 1)) or \
+                        (walkable(x, y + 1) and not walkable(x - dx, y + 1)):
+                    return x, y
+            else:
+                if (walkable(x - 1, y) and not walkable(x - 1, y - dy)) or \
+                        (walkable(x + 1, y) and not walkable(x + 1, y - dy)):
+                    return x, y
+                if self.jump(x + 1, y, 1, 0) is not None or self.jump(x - 1, y, -1, 0) is not None:
+                    return x, y
+
+            x += dx
+            y += dy
+
+        return None
+
+    def expand_jump_path(self, path):
+        """
+        Fills in the straight segments between the jump points of a path
+        :param path: A list of jump points, from the last node back to the start node
+        :return: The path with every cell in between
+        """
+        if len(path) < 2:
+            return path
+
+        expanded = [path[0]]
+        for node, previous in zip(path[1:], path):
+            dx = (node.x > previous.x) - (node.x < previous.x)
+            dy = (node.y > previous.y) - (node.y < previous.y)
+            x, y = previous.x + dx, previous.y + dy
+            while (x, y) != (node.x, node.y):
+                expanded.append(self.get_node(x, y))
+                x += dx
+                y += dy
+            expanded.append(node)
+
+        return expanded
+
+    def get_abstraction(self, cluster_size=HPA_CLUSTER_SIZE):
+        """
+        Returns the cluster abstraction of the board for hierarchical search, building it on first use
+        :param cluster_size: Side length of the clusters, the abstraction is rebuilt if it changes
+        :return: A ClusterAbstraction connected to the start and goal nodes
+        """
+        if self.abstraction is None or self.abstraction.cluster_size != cluster_size:
+            self.abstraction = ClusterAbstraction(self, cluster_size=cluster_size)
+
+        self.abstraction.connect(
+            (self.start_node.x, self.start_node.y),
+            (self.goal_node.x, self.goal_node.y)
+        )
+        return self.abstraction
+
+    def get_abstract_successors(self, node):
+        """
+        Hierarchical search successor function. Returns the abstract nodes connected to the node
+        :param node: The start node or an abstract node
+        :return: A list of (abstract node, cost of the abstract arc) tuples
+        """
+        return [
+            (self.get_node(x, y), cost) for (x, y), cost in self.get_abstraction().successors((node.x, node.y))
+        ]
+
+    def expand_abstract_path(self, path):
+        """
+        Refines the abstract arcs of a path into board cells
+        :param path: A list of abstract nodes, from the last node back to the start node
+        :return: The path with every cell in between
+        """
+        if len(path) < 2:
+            return path
+
+        abstraction = self.get_abstraction()
+        expanded = [path[0]]
+        for node, previous in zip(path[1:], path):
+            cells = abstraction.refine((node.x, node.y), (previous.x, previous.y))
+            expanded.extend(self.get_node(x, y) for x, y in reversed(cells[:-1]))
+
+        return expanded
+
     def heuristic(self, node):
         """
         Heuristic function. Here implemented as Manhattan distance
         :param node: The node to perform the heuristic function on
         """
 
+        return self.distance_estimate(node, self.goal_node)
+
+    def distance_estimate(self, node, target, reverse=False):
+        """
+        Estimates the distance between two nodes with the selected heuristic. Terrain is charged for leaving a cell,
+        so on boards with terrain the distance depends on the direction
+        :param node: The node to estimate from
+        :param target: The node to estimate to
+        :param reverse: Estimate the distance from the target to the node instead, as a backward search needs
+        """
+
+        source, destination = (target, node) if reverse else (node, target)
         return {
-            'manhattan': lambda: abs(node.x - self.goal_node.x) + abs(node.y - self.goal_node.y),
-            'euclidean': lambda: sqrt(pow((node.x - self.goal_node.x), 2) + pow((node.y - self.goal_node.y), 2))
+            'manhattan': lambda: abs(node.x - target.x) + abs(node.y - target.y),
+            'euclidean': lambda: sqrt(pow((node.x - target.x), 2) + pow((node.y - target.y), 2)),
+            'landmarks': lambda: max(
+                abs(node.x - target.x) + abs(node.y - target.y),
+                self.get_landmarks().estimate(source.x, source.y, destination.x, destination.y)
+            ),
+            'exact': lambda: self.get_distance_field((target.x, target.y), reverse=not reverse)[
+                node.y * self.width + node.x
+            ]
         }.get(self.mode)()
 
+    def has_uniform_costs(self):
+        """
+        Returns whether every walkable cell has the same arc cost
+        """
+        if self.uniform_costs is None:
+            self.uniform_costs = has_uniform_costs(self)
+        return self.uniform_costs
+
+    def has_integer_costs(self):
+        """
+        Returns whether every arc cost and heuristic value is an integer, so the best-first agenda can be a bucket queue.
+        Holds for the Manhattan and landmark heuristics on boards without fractional arc costs
+        """
+        if self.mode not in ('manhattan', 'landmarks'):
+            return False
+        if self.integer_costs is None:
+            self.integer_costs = has_integer_costs(self)
+        return self.integer_costs
+
+    def get_distance_field(self, source, reverse=False):
+        """
+        Returns the distances from a cell to every cell of the board, or from every cell to it if reverse is set.
+        The most recently used fields are cached, so an exact field is only computed once per goal
+        :param source: The (x, y) to measure from
+        :param reverse: Measure the distance to the source instead
+        :return: An array of distances indexed by y * width + x, infinite for cells that cannot be reached
+        """
+        key = (tuple(source), reverse and not self.has_uniform_costs())
+        if key in self.distance_fields:
+            self.distance_fields.move_to_end(key)
+            return self.distance_fields[key]
+
+        field = distance_field(self, source, reverse=reverse)
+        self.distance_fields[key] = field
+        if len(self.distance_fields) > DISTANCE_FIELD_CACHE:
+            self.distance_fields.popitem(last=False)
+        return field
+
+    def get_distance_matrix(self, points):
+        """
+        Returns the distances between every pair of the given cells
+        :param points: A list of (x, y) cells
+        :return: A list of rows, where row i holds the distances from points[i] to every point
+        """
+        return distance_matrix(self, points)
+
+    def get_landmarks(self):
+        """
+        Returns the landmark table of the board, loading or building it on first use
+        :return: A LandmarkTable
+        """
+        if self.landmarks is None:
+            self.landmarks = LandmarkTable.build(self) if self.modified else load_landmarks(self)
+        return self.landmarks
+
     def arc_cost(self, node):
         """
         Fetches the arc cost of the given node
@@ -85,6 +391,14 @@ class NavigationProblem(AStarProblem):
         """
         return node.arc_cost
 
+    def arc_cost_at(self, x, y):
+        """
+        Fetches the arc cost of the cell at the given coordinates
+        :param x: X coordinate
+        :param y: Y coordinate
+        """
+        return self.grid[y][x].arc_cost
+
     def get_node(self, x, y):
         """
         Returns a node on the given index
@@ -120,3 +434,369 @@ class NavigationProblem(AStarProblem):
         for row in reversed(self.grid):
             string += "%s\n" % repr(row)
         return string
+
+
+class CompactGrid(object):
+    """
+    Read-only row view of a CompactNavigationProblem, so code written against the nested
+    list grid of the NavigationProblem (like the renderer) keeps working. Rows are materialized on access
+    """
+
+    def __init__(self, problem):
+        self.problem = problem
+
+    def __len__(self):
+        return self.problem.height
+
+    def __getitem__(self, y):
+        if y < 0:
+            y += self.problem.height
+        if not 0 <= y < self.problem.height:
+            raise IndexError('grid row out of range')
+        return [self.problem.get_node(x, y) for x in range(self.problem.width)]
+
+
+class CompactNavigationProblem(NavigationProblem):
+    """
+    NavigationProblem that keeps the board as flat bytearrays of walkable flags and arc costs indexed by cell id
+    (y * width + x), instead of one AStarState per cell. Cell objects are only materialized when asked for, and are kept in a weak
+    cache so a cell keeps its identity for as long as anybody holds on to it.
+    Search it with the GridAStar engine to keep the per search state in flat arrays as well.
+    """
+
+    def __init__(self, board_path, mode='manhattan'):
+        """
+        Initiating the compact board from file
+        """
+
+        self.width = 0
+        self.height = 0
+        self.walkable = bytearray()
+        self.costs = bytearray()
+        self.start = None
+        self.goal = None
+        self.cells = WeakValueDictionary()
+
+        super(CompactNavigationProblem, self).__init__(board_path, mode=mode)
+
+    def init_grid_from_file(self):
+        """
+        Reads and parses the board file into the walkable and cost arrays
+        """
+        self.width, self.height, (sx, sy), (gx, gy), obstacles, terrain = read_board(self.board_path)
+        self.walkable = bytearray(b'\x01') * (self.width * self.height)
+        self.costs = bytearray(b'\x01') * (self.width * self.height)
+
+        for ox, oy, ow, oh in obstacles:
+            ow = min(ow, self.width - ox)
+            for y in range(oy, min(oy + oh, self.height)):
+                start = y * self.width + ox
+                self.walkable[start:start + ow] = bytes(ow)
+
+        for tx, ty, tw, th, cost in terrain:
+            if cost > 255:
+                raise Exception('Compact boards only hold terrain costs up to 255, got %d' % cost)
+            tw = min(tw, self.width - tx)
+            for y in range(ty, min(ty + th, self.height)):
+                start = y * self.width + tx
+                self.costs[start:start + tw] = bytes([cost]) * tw
+
+        self.start = self.cell_id(sx, sy)
+        self.goal = self.cell_id(gx, gy)
+        self.grid = CompactGrid(self)
+        self.start_node = self.get_node(sx, sy)
+        self.goal_node = self.get_node(gx, gy)
+
+    def set_query(self, start, goal, touched=()):
+        """
+        Moves the start and goal of the board, see NavigationProblem.set_query
+        """
+        super(CompactNavigationProblem, self).set_query(start, goal, touched=touched)
+        self.start = self.cell_id(*start)
+        self.goal = self.cell_id(*goal)
+
+    def has_uniform_costs(self):
+        """
+        Returns whether every walkable cell has the same arc cost, read straight from the cost array
+        """
+        if self.uniform_costs is None:
+            self.uniform_costs = len({
+                cost for cost, walkable in zip(self.costs, self.walkable) if walkable
+            }) <= 1
+        return self.uniform_costs
+
+    def has_integer_costs(self):
+        """
+        The arc costs of a compact board are always integers, so only the heuristic decides
+        """
+        return self.mode in ('manhattan', 'landmarks')
+
+    def set_walkable(self, x, y, walkable):
+        """
+        Blocks or clears a cell of the loaded board, see NavigationProblem.set_walkable
+        """
+        self.walkable[self.cell_id(x, y)] = 1 if walkable else 0
+        return super(CompactNavigationProblem, self).set_walkable(x, y, walkable)
+
+    def cell_id(self, x, y):
+        """
+        Returns the flat index of a cell
+        """
+        return y * self.width + x
+
+    def neighbours(self, cell):
+        """
+        Returns the ids of all walkable cells adjacent to a cell, in the same order as get_all_successor_nodes
+        :param cell: Cell id
+        :return: A list of cell ids
+        """
+        width = self.width
+        walkable = self.walkable
+        y, x = divmod(cell, width)
+        cells = []
+
+        if x < width - 1 and walkable[cell + 1]:
+            cells.append(cell + 1)
+        if y > 0 and walkable[cell - width]:
+            cells.append(cell - width)
+        if x > 0 and walkable[cell - 1]:
+            cells.append(cell - 1)
+        if y < self.height - 1 and walkable[cell + width]:
+            cells.append(cell + width)
+
+        return cells
+
+    def arc_cost_at(self, x, y):
+        """
+        Fetches the arc cost of a cell straight from the cost array, without materializing the cell
+        :param x: X coordinate
+        :param y: Y coordinate
+        """
+        return self.costs[y * self.width + x]
+
+    def is_walkable(self, x, y):
+        """
+        Returns whether the given coordinates are inside the board and not an obstacle, without materializing the cell
+        :param x: X coordinate
+        :param y: Y coordinate
+        """
+        return 0 <= x < self.width and 0 <= y < self.height and self.walkable[y * self.width + x] == 1
+
+    def estimate(self, cell):
+        """
+        Heuristic function working directly on cell ids
+        :param cell: Cell id
+        :return: The estimated distance to the goal
+        """
+        y, x = divmod(cell, self.width)
+        gy, gx = divmod(self.goal, self.width)
+        if self.mode == 'euclidean':
+            return sqrt((x - gx) ** 2 + (y - gy) ** 2)
+        if self.mode == 'landmarks':
+            return max(abs(x - gx) + abs(y - gy), self.get_landmarks().estimate(x, y, gx, gy))
+        if self.mode == 'exact':
+            return self.get_distance_field((gx, gy), reverse=True)[cell]
+        return abs(x - gx) + abs(y - gy)
+
+    def get_all_successor_nodes(self, node):
+        """
+        Returns all adjacent nodes to the node parameter
+        :param node: The node to find adjacent nodes to
+        """
+        return [self.get_node(*self.coordinates(cell)) for cell in self.neighbours(node.index)]
+
+    def coordinates(self, cell):
+        """
+        Returns the (x, y) coordinates of a cell id
+        """
+        y, x = divmod(cell, self.width)
+        return x, y
+
+    def get_node(self, x, y):
+        """
+        Materializes the node on the given coordinates
+        :param x: X coordinate
+        :param y: Y coordinate
+        :return: AStarNode instance
+        """
+        cell = self.cell_id(x, y)
+        node = self.cells.get(cell)
+        if node is None:
+            node = AStarState(index=cell, x=x, y=y)
+            node.walkable = bool(self.walkable[cell])
+            node.arc_cost = self.costs[cell]
+            node.is_start = cell == self.start or None
+            node.is_goal = cell == self.goal or None
+            self.cells[cell] = node
+        return node
+
+
+class CellSet(object):
+    """
+    A set of cell ids backed by a bytearray with one flag per cell
+    """
+
+    def __init__(self, size):
+        self.flags = bytearray(size)
+        self.size = 0
+
+    def add(self, cell):
+        if not self.flags[cell]:
+            self.flags[cell] = 1
+            self.size += 1
+
+    def discard(self, cell):
+        if self.flags[cell]:
+            self.flags[cell] = 0
+            self.size -= 1
+
+    def __contains__(self, cell):
+        return self.flags[cell] == 1
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        return (cell for cell, flag in enumerate(self.flags) if flag)
+
+
+class GridAStar(object):
+    """
+    A* engine for the CompactNavigationProblem. Works on cell ids, and stores G, F and parent values in flat arrays
+    allocated once per search, so no node objects are created while searching. It mirrors the AStar interface: the
+    same modes and agendas, and a step stream where the expanded node, its parent, the opened nodes and the path
+    are materialized as AStarState objects for reporting.
+    :param mode: The mode to run the A* algorithm in
+    :param problem: The CompactNavigationProblem to run A* on
+    :param snapshot_interval: Only yield a step every N expansions. The goal step and the last step are always yielded
+    :param tie_break: 'fifo' or 'lifo', which of the cells with equal F and H values the best-first agenda takes first
+    """
+
+    def __init__(self, mode='best', problem=None, snapshot_interval=1, tie_break='fifo'):
+        """
+        Initializing the engine and the per search arrays
+        """
+        if not isinstance(problem, CompactNavigationProblem):
+            raise Exception("Problem must be an instance of CompactNavigationProblem")
+        if mode not in GRID_ASTAR_MODES:
+            raise Exception("Unsupported GridAStar mode: %s" % mode)
+
+        self.mode = mode
+        self.problem = problem
+        self.snapshot_interval = max(1, snapshot_interval)
+
+        size = problem.width * problem.height
+        self.g = array('d', [float('inf')]) * size
+        self.f = array('d', [float('inf')]) * size
+        self.parent = array('i', [-1]) * size
+
+        self.open_set = create_agenda(mode, problem, tie_break=tie_break)
+        self.closed_set = CellSet(size)
+
+        self.start_node = problem.start
+        self.goal_node = None
+
+        self.stats = {
+            'expanded': 0,
+            'generated': 0
+        }
+
+        log('GridAStar initiated with %d cells' % size)
+
+    def agenda_loop(self):
+        """
+        The A* main loop, on cell ids
+        """
+        problem = self.problem
+        costs = problem.costs
+        g, f, parent = self.g, self.f, self.parent
+        open_set, closed_set = self.open_set, self.closed_set
+        stats = self.stats
+
+        h = problem.estimate(problem.start)
+        g[problem.start] = 0
+        f[problem.start] = h
+        open_set.add(problem.start, h, h)
+        step = None
+
+        while len(open_set):
+            cell = open_set.pop()
+            closed_set.add(cell)
+            stats['expanded'] += 1
+
+            if cell == problem.goal:
+                log('Reached the goal node for this problem instance')
+                self.goal_node = self.materialize(cell)
+                yield self.create_step(cell, [])
+                return
+
+            cost = g[cell] + costs[cell]
+            opened = []
+
+            for successor in problem.neighbours(cell):
+                if cost < g[successor]:
+                    if g[successor] == float('inf'):
+                        h = problem.estimate(successor)
+                        opened.append(successor)
+                        stats['generated'] += 1
+                    else:
+                        h = f[successor] - g[successor]
+
+                    g[successor] = cost
+                    f[successor] = cost + h
+                    parent[successor] = cell
+
+                    # Closed cells are only re-parented. With the consistent grid heuristics this only happens
+                    # in the blind modes, where the extra cost of propagating the improvement is not worth it
+                    if successor not in closed_set:
+                        open_set.add(successor, cost + h, h)
+
+            step = (cell, opened)
+            if stats['expanded'] % self.snapshot_interval == 0:
+                yield self.create_step(cell, opened)
+                step = None
+
+        # Make sure the caller always sees the last expansion of an exhausted search
+        if step is not None:
+            yield self.create_step(*step)
+
+    def materialize(self, cell):
+        """
+        Returns the node of a cell, with the G, H and F values of this search
+        :param cell: Cell id
+        :return: AStarState instance
+        """
+        node = self.problem.get_node(*self.problem.coordinates(cell))
+        node.g = self.g[cell]
+        node.f = self.f[cell]
+        node.h = node.f - node.g
+        return node
+
+    def create_step(self, cell, opened):
+        """
+        Creates a step for the step stream, materializing the changed cells
+        :param cell: The expanded cell
+        :param opened: The cells that were added to the open set by this expansion
+        :return: A SearchStep
+        """
+        parent = self.parent[cell]
+        return SearchStep(
+            lambda n: self.get_path_from_node([n]),
+            node=self.materialize(cell),
+            parent=self.materialize(parent) if parent >= 0 else None,
+            opened=[self.materialize(c) for c in opened],
+            open_set=self.open_set,
+            closed_set=self.closed_set
+        )
+
+    def get_path_from_node(self, path):
+        """
+        Returns the path from the last node in the given list back to the start node
+        :param path: A list ending in the node to walk back from
+        :return: The path as materialized nodes
+        """
+        cell = self.parent[path[-1].index]
+        while cell >= 0:
+            path.append(self.materialize(cell))
+            cell = self.parent[cell]
+        return path
@@ -2,20 +2,24 @@
 #
 # Created by 'hakloev' on 9/9/15
 
-from copy import deepcopy
-from algorithms import AStarProblem, GAC
-from datastructures import AStarState, CSPState
+from algorithms import AStarProblem, GAC_ENGINES, GAC_DEFAULT_ENGINE
+from datastructures import AStarState, CSPState, BitsetCSPState
 from common import *
 
 
 class VCProblem(AStarProblem):
 
-    def __init__(self, nodes, edges, cf=lambda x, y: x != y):
+    def __init__(self, nodes, edges, cf=lambda x, y: x != y, engine=GAC_DEFAULT_ENGINE):
         """
         Constructor for VCProblem
         :param nodes: nodes in the VC-problem
         :param edges: edges between the nodes in the VC-problem
+        :param engine: Name of the propagation engine in GAC_ENGINES. The bitset engine keeps the domains as bitmasks,
+        and only propagates the x != y constraint, ignoring cf
         """
+        if engine not in GAC_ENGINES:
+            raise Exception('Unknown propagation engine: %s' % engine)
+
         self.constraints = {}
         for from_node, to_node in edges:
             if from_node not in self.constraints:
@@ -25,7 +29,12 @@ class VCProblem(AStarProblem):
                 self.constraints[to_node] = []
             self.constraints[to_node].append(from_node)
 
-        self.gac = GAC(csp_state=CSPState(nodes), cnet=self.constraints, cf=cf)
+        if engine == 'bitset':
+            csp_state = BitsetCSPState.from_domains(nodes)
+        else:
+            csp_state = CSPState(nodes)
+
+        self.gac = GAC_ENGINES[engine](csp_state=csp_state, cnet=self.constraints, cf=cf)
 
         self.gac.initialize()
         self.gac.domain_filtering_loop()
@@ -37,7 +46,6 @@ class VCProblem(AStarProblem):
         h = self.heuristic(self.initial_state)
         if h == 0:
             log("Found solution for VCProblem after first domain filtering loop")
-            print("Found solution for VCProblem after first domain filtering loop")  # Should add debug flag here!
 
     def get_start_node(self):
         """
@@ -63,14 +71,45 @@ class VCProblem(AStarProblem):
         csp_state = astar_state.state
         successor_nodes = []
 
+        if isinstance(csp_state, BitsetCSPState):
+            return self.get_bitset_successor_nodes(csp_state)
+
         for node, domains in csp_state.nodes.items():
             if len(domains) > 1:
-                for d in range(len(domains)):
-                    child_state = deepcopy(csp_state)
-                    child_state.nodes[node] = {list(domains)[d]}
-
+                self.gac.csp_state = csp_state
+                for value in list(domains):
                     if DEBUG:
-                        print("Domain for %s is now %s" % (node, str(child_state.nodes[node])))
+                        print("Domain for %s is now %s" % (node, str({value})))
+
+                    # The child shares every domain the propagation leaves alone with the expanded state
+                    child_state = self.gac.assign(node, {value})
+                    if child_state is not None:
+                        astar_state = AStarState()
+                        astar_state.state = child_state
+                        successor_nodes.append(astar_state)
+
+                return successor_nodes
+
+    def get_bitset_successor_nodes(self, csp_state):
+        """
+        Fetches all successor nodes from a given BitsetCSPState, by assigning every value left in the domain of the
+        first node with more than one value, lowest value first
+        :param csp_state: The state to branch on
+        :return: The generated successor nodes
+        """
+        successor_nodes = []
+
+        for node, position in csp_state.index.items():
+            mask = csp_state.masks[position]
+            if mask & (mask - 1):
+                removed = mask.bit_count() - 1
+                while mask:
+                    bit = mask & -mask
+                    mask ^= bit
+
+                    child_state = csp_state.copy()
+                    child_state.masks[position] = bit
+                    child_state.total -= removed
 
                     self.gac.csp_state = child_state
                     self.gac.run_again(node)
@@ -94,7 +133,7 @@ class VCProblem(AStarProblem):
         :param: The state to calculate the heuristic on
         :return: The heuristic for the given state
         """
-        h = sum((len(domains) - 1) for domains in astar_state.state.nodes.values())
+        h = astar_state.state.domain_size_total() - len(astar_state.state.nodes)
         if h == 0:
             self.goal_node = astar_state
             astar_state.is_goal = True
@@ -113,3 +152,10 @@ class VCProblem(AStarProblem):
         :return: The calculated arc cost
         """
         return 1
+
+    def has_integer_costs(self):
+        """
+        Arcs cost 1 and the heuristic sums domain sizes, so every F value is an integer
+        :return: True
+        """
+        return True
@@ -4,18 +4,25 @@
 
 from copy import deepcopy
 
-from algorithms import AStarProblem, GAC
+from algorithms import AStarProblem, GAC_ENGINES, GAC_DEFAULT_ENGINE
 from common import *
 from datastructures import AStarState, CSPState
 
 
 class NonogramProblem(AStarProblem):
 
-    def __init__(self, path):
+    def __init__(self, path, engine=GAC_DEFAULT_ENGINE):
         """
         Constructor for the NonogramProblem
         Will set up the grid and create all nodes with all possible permutations as domains
+        Patterns are stored as tuples, so the domain values are hashable
+        :param path: Path to the nonogram file
+        :param engine: Name of the propagation engine in GAC_ENGINES
         """
+        if engine not in GAC_ENGINES:
+            raise Exception('Unknown propagation engine: %s' % engine)
+        if engine == 'bitset':
+            raise Exception('The bitset engine only propagates graph colorings')
 
         self.nodes = {}
         with open(path) as f:
@@ -29,10 +36,10 @@ class NonogramProblem(AStarProblem):
             for row in range(rows):
                 r_reversed.append(list(map(int, f.readline().split())))
             for row, counts in enumerate(reversed(r_reversed)):
-                self.nodes[row] = [(row, p) for p in self.gen_patterns(counts, cols)]
+                self.nodes[row] = [(row, tuple(p)) for p in self.gen_patterns(counts, cols)]
             for col in range(cols):
                 counts = list(map(int, f.readline().split()))
-                self.nodes[rows + col] = [(col, p) for p in self.gen_patterns(counts, rows)]
+                self.nodes[rows + col] = [(col, tuple(p)) for p in self.gen_patterns(counts, rows)]
 
         if DEBUG:
             for x in range(rows + cols):
@@ -46,7 +53,7 @@ class NonogramProblem(AStarProblem):
             c, domain_b = b
             return domain_a[c] == domain_b[r]
 
-        self.gac = GAC(cnet=self.constraints, csp_state=CSPState(self.nodes), cf=cf)
+        self.gac = GAC_ENGINES[engine](cnet=self.constraints, csp_state=CSPState(self.nodes), cf=cf)
         self.gac.initialize()
         self.gac.domain_filtering_loop()
         self.initial_state = AStarState()
@@ -121,7 +128,7 @@ class NonogramProblem(AStarProblem):
         :param astar_state: The state to calculate h for
         :return: The h value
         """
-        h = sum((len(domains) - 1) for domains in astar_state.state.nodes.values())
+        h = astar_state.state.domain_size_total() - len(astar_state.state.nodes)
         if h == 0:
             astar_state.is_goal = True
         astar_state.h = h
@@ -135,6 +142,13 @@ class NonogramProblem(AStarProblem):
         """
         return 1
 
+    def has_integer_costs(self):
+        """
+        Arcs cost 1 and the heuristic sums pattern counts, so every F value is an integer
+        :return: True
+        """
+        return True
+
     def get_goal_node(self):
         """
         Returns the goal node for the problem instance
@@ -155,17 +169,14 @@ class NonogramProblem(AStarProblem):
 
         for node, domains in csp_state.nodes.items():
             if len(domains) > 1:
-                for d in range(len(domains)):
-                    child_state = deepcopy(csp_state)
-                    child_state.nodes[node] = [list(domains)[d]]
-
+                self.gac.csp_state = csp_state
+                for value in list(domains):
                     if DEBUG:
-                        print("Domain for %s is now %s" % (node, str(child_state.nodes[node])))
-
-                    self.gac.csp_state = child_state
-                    self.gac.run_again(node)
+                        print("Domain for %s is now %s" % (node, str([value])))
 
-                    if not child_state.contradiction:
+                    # The child shares every domain the propagation leaves alone with the expanded state
+                    child_state = self.gac.assign(node, [value])
+                    if child_state is not None:
                         astar_state = AStarState()
                         astar_state.state = child_state
                         successor_nodes.append(astar_state)
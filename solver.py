@@ -0,0 +1,555 @@
+# -*- coding: utf8 -*-
+
+import argparse
+import inspect
+import json
+import multiprocessing
+import sys
+import time
+import tracemalloc
+
+from algorithms import create_search as create_astar, AStar, ASTAR_ENGINES, ASTAR_OPTIONS, ASTAR_HEURISTIC, \
+    GAC_DEFAULT_K, GAC_DEFAULT_CONSTRAINT, GAC_DEFAULT_ENGINE, GAC_ENGINES
+from common import *
+from datastructures import Graph
+from module1.navigation import NavigationProblem, CompactNavigationProblem, GridAStar, GRID_ASTAR_MODES
+from module2.vc import VCProblem
+from module3.nonogram import NonogramProblem
+
+# Maps the directory a problem file is bundled in to the problem type
+PROBLEM_TYPES = {
+    'boards': 'board',
+    'graphs': 'graph',
+    'nonograms': 'nonogram'
+}
+
+
+def detect_problem_type(file_path):
+    """
+    Guesses the problem type of a file from the directory it lives in
+    :param file_path: Path to a board, graph or nonogram file
+    :return: One of 'board', 'graph' or 'nonogram'
+    """
+
+    directory = os.path.basename(os.path.dirname(os.path.abspath(file_path)))
+    if directory not in PROBLEM_TYPES:
+        raise Exception('Cannot detect problem type of %s, please provide it explicitly' % file_path)
+
+    return PROBLEM_TYPES[directory]
+
+
+def load_problem(file_path, problem_type=None, heuristic=ASTAR_HEURISTIC[0], k=GAC_DEFAULT_K,
+                 constraint=GAC_DEFAULT_CONSTRAINT, compact=False, engine=GAC_DEFAULT_ENGINE):
+    """
+    Loads a problem file into the matching AStarProblem, without touching any GUI module
+    :param file_path: Path to a board, graph or nonogram file
+    :param problem_type: One of 'board', 'graph' or 'nonogram'. Detected from the path if not provided
+    :param heuristic: The heuristic to use for boards
+    :param k: The number of colors to use for graphs
+    :param constraint: The constraint formula to use for graphs
+    :param compact: Whether to load boards into the array backed CompactNavigationProblem
+    :param engine: The propagation engine to use for graphs and nonograms
+    :return: The problem instance
+    """
+
+    problem_type = problem_type or detect_problem_type(file_path)
+
+    if problem_type == 'board':
+        if compact:
+            problem = CompactNavigationProblem(file_path, mode=heuristic)
+        else:
+            problem = NavigationProblem(file_path, mode=heuristic)
+        if heuristic == 'landmarks':
+            problem.get_landmarks()
+        return problem
+    elif problem_type == 'graph':
+        if engine == 'bitset' and constraint.replace(' ', '') != 'x!=y':
+            raise Exception('The bitset engine only propagates the x != y constraint')
+        nodes, edges = Graph.read_graph_from_file(file_path, lightweight=True)
+        domains = {node: set(range(k)) for node in nodes}
+        return VCProblem(domains, edges, cf=make_func(['x', 'y'], constraint), engine=engine)
+    elif problem_type == 'nonogram':
+        return NonogramProblem(file_path, engine=engine)
+
+    raise Exception('Unknown problem type: %s' % problem_type)
+
+
+def describe_solution(problem, node, path):
+    """
+    Creates a JSON serializable description of a solution
+    :param problem: The solved problem
+    :param node: The goal node
+    :param path: The path from the goal node back to the start node
+    :return: The board path as (x, y) pairs, the color of every vertex, or the nonogram rows
+    """
+
+    if isinstance(problem, NavigationProblem):
+        return [(n.x, n.y) for n in reversed(path)]
+    elif isinstance(problem, VCProblem):
+        return {str(vertex): list(domain)[0] for vertex, domain in sorted(node.state.nodes.items())}
+    elif isinstance(problem, NonogramProblem):
+        # Rows are stored in reverse, so flip them back to the order of the input file
+        return [
+            ''.join('#' if cell else '.' for cell in node.state.nodes[row][0][1])
+            for row in reversed(range(problem.total_rows))
+        ]
+
+
+def check_search_options(mode, low_memory=False, weight=1.0):
+    """
+    Makes sure the engine of a mode supports the options that differ from the defaults
+    :param mode: The A* mode to run in
+    :param low_memory: Whether to run A* without child bookkeeping and the parent_of dict
+    :param weight: Weight on the heuristic, or the initial weight in ara mode
+    """
+
+    parameters = inspect.signature(ASTAR_ENGINES.get(mode, AStar).__init__).parameters
+    for option, used in (('low_memory', low_memory), ('weight', weight != 1)):
+        if used and option not in parameters:
+            raise ValueError('The %s mode does not support the %s option' % (mode, option))
+
+
+def create_search(problem, mode=ASTAR_OPTIONS[0], tie_break='fifo', low_memory=False, weight=1.0):
+    """
+    Creates the search engine for a problem
+    :param problem: The AStarProblem to solve
+    :param mode: The A* mode to run in
+    :param tie_break: 'fifo' or 'lifo' tie breaking between nodes with equal F and H values
+    :param low_memory: Whether to run A* without child bookkeeping and the parent_of dict
+    :param weight: Weight on the heuristic, or the initial weight in ara mode
+    :return: A GridAStar for compact boards in the modes it supports, the engine for the mode otherwise
+    """
+
+    check_search_options(mode, low_memory=low_memory, weight=weight)
+    if isinstance(problem, CompactNavigationProblem) and mode in GRID_ASTAR_MODES and weight == 1:
+        return GridAStar(mode=mode, problem=problem, tie_break=tie_break)
+
+    # Only pass the options that differ from the defaults, since not every engine supports them
+    options = {'tie_break': tie_break}
+    if low_memory:
+        options['low_memory'] = low_memory
+    if weight != 1:
+        options['weight'] = weight
+    return create_astar(problem, mode=mode, **options)
+
+
+def run_search(solver, t, time_limit):
+    """
+    Drives the step stream of a search engine until it is done or out of time
+    :param solver: The search engine
+    :param t: The perf_counter time the search started at
+    :param time_limit: Maximum number of seconds to search for
+    :return: The status, and the path to the goal node or to the last expanded node
+    """
+
+    status = 'unsolvable'
+    step = None
+    path = None
+
+    for step in solver.agenda_loop():
+        if solver.goal_node is not None:
+            status = 'solved'
+            if step['node'] is solver.goal_node:
+                path = step['path']
+        if time.perf_counter() - t > time_limit:
+            if status != 'solved':
+                status = 'timeout'
+            break
+
+    if path is None:
+        path = step['path'] if step else []
+    return status, path
+
+
+def solve(problem, mode=ASTAR_OPTIONS[0], tie_break='fifo', low_memory=False, weight=1.0,
+          time_limit=TIMEOUT_THRESHOLD, trace_memory=True):
+    """
+    Runs A* on a problem until it is solved, exhausted or out of time.
+    Anytime searches keep improving their solution until they are done or out of time
+    :param problem: The AStarProblem to solve
+    :param mode: The A* mode to run in
+    :param tie_break: 'fifo' or 'lifo' tie breaking between nodes with equal F and H values
+    :param low_memory: Whether to run A* without child bookkeeping and the parent_of dict
+    :param weight: Weight on the heuristic, or the initial weight in ara mode
+    :param time_limit: Maximum number of seconds to search for
+    :param trace_memory: Whether to record the peak memory allocated during the search
+    :return: A dictionary with the outcome and the search statistics
+    """
+
+    if trace_memory:
+        tracemalloc.start()
+
+    t = time.perf_counter()
+    solver = create_search(problem, mode=mode, tie_break=tie_break, low_memory=low_memory, weight=weight)
+    status, path = run_search(solver, t, time_limit)
+    wall_time = time.perf_counter() - t
+    peak_memory = None
+    if trace_memory:
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        'status': status,
+        'solution': describe_solution(problem, solver.goal_node, path) if status == 'solved' else None,
+        'path_length': len(path) - 1 if path else None,
+        'path_cost': sum(problem.arc_cost(node) for node in path[1:]) if path else None,
+        'expansions': solver.stats['expanded'],
+        'generated': solver.stats['generated'],
+        'search_stats': dict(solver.stats),
+        'propagation_stats': dict(problem.gac.stats) if hasattr(problem, 'gac') else None,
+        'bound': getattr(solver, 'bound', None),
+        'open_set_size': len(solver.open_set),
+        'closed_set_size': len(solver.closed_set),
+        'wall_time': wall_time,
+        'peak_memory': peak_memory
+    }
+
+
+def run_file(file_path, problem_type=None, mode=ASTAR_OPTIONS[0], heuristic=ASTAR_HEURISTIC[0], k=GAC_DEFAULT_K,
+             constraint=GAC_DEFAULT_CONSTRAINT, compact=False, tie_break='fifo', low_memory=False, weight=1.0,
+             time_limit=TIMEOUT_THRESHOLD, trace_memory=True, engine=GAC_DEFAULT_ENGINE):
+    """
+    Loads and solves a single problem file
+    :return: A dictionary describing the run, the options used and its outcome
+    """
+
+    problem_type = problem_type or detect_problem_type(file_path)
+
+    t = time.perf_counter()
+    problem = load_problem(
+        file_path,
+        problem_type=problem_type,
+        heuristic=heuristic,
+        k=k,
+        constraint=constraint,
+        compact=compact,
+        engine=engine
+    )
+    if mode == 'hpa' and isinstance(problem, NavigationProblem):
+        # The abstraction is built once per board and shared by every query on it, so it counts as loading
+        problem.get_abstraction()
+    load_time = time.perf_counter() - t
+
+    result = {
+        'file': file_path,
+        'type': problem_type,
+        'mode': mode,
+        'tie_break': tie_break,
+        'low_memory': low_memory,
+        'weight': weight,
+        'load_time': load_time
+    }
+    if problem_type == 'board':
+        result['heuristic'] = heuristic
+        result['compact'] = compact
+    elif problem_type == 'graph':
+        result['k'] = k
+        result['constraint'] = constraint
+    if problem_type in ('graph', 'nonogram'):
+        result['engine'] = engine
+
+    result.update(solve(
+        problem,
+        mode=mode,
+        tie_break=tie_break,
+        low_memory=low_memory,
+        weight=weight,
+        time_limit=time_limit,
+        trace_memory=trace_memory
+    ))
+    return result
+
+
+def read_queries(file_path):
+    """
+    Reads a query file with one 'sx sy gx gy' start and goal pair per line
+    :param file_path: Path to the query file
+    :return: A list of ((sx, sy), (gx, gy)) tuples
+    """
+
+    with open(file_path) as f:
+        values = [tuple(map(int, line.split())) for line in f if line.strip()]
+
+    for line in values:
+        if len(line) != 4:
+            raise Exception('Queries must have 4 coordinates, got %s' % (line,))
+    return [((sx, sy), (gx, gy)) for sx, sy, gx, gy in values]
+
+
+def touched_nodes(solver):
+    """
+    Returns the nodes a finished search may have written per search values to
+    """
+
+    if isinstance(solver, GridAStar):
+        # The grid engine keeps its values in arrays of its own
+        return []
+    return list(solver.open_set) + list(solver.closed_set)
+
+
+def solve_queries(problem, queries, mode=ASTAR_OPTIONS[0], tie_break='fifo', low_memory=False, weight=1.0,
+                  time_limit=TIMEOUT_THRESHOLD):
+    """
+    Solves a list of start and goal pairs on one loaded board. Only the nodes touched by a search are reset
+    before the next one, instead of reloading the board
+    :param problem: The NavigationProblem to query
+    :param queries: A list of ((sx, sy), (gx, gy)) tuples
+    :return: A list with the outcome of every query
+    """
+
+    results = []
+    touched = []
+    for start, goal in queries:
+        t = time.perf_counter()
+        problem.set_query(start, goal, touched=touched)
+        solver = create_search(problem, mode=mode, tie_break=tie_break, low_memory=low_memory, weight=weight)
+        status, path = run_search(solver, t, time_limit)
+        touched = touched_nodes(solver)
+
+        results.append({
+            'start': start,
+            'goal': goal,
+            'status': status,
+            'path_length': len(path) - 1 if status == 'solved' else None,
+            # Arcs are charged for leaving a cell, so every node but the goal at the front of the path pays its cost
+            'path_cost': sum(problem.arc_cost(node) for node in path[1:]) if status == 'solved' else None,
+            'expansions': solver.stats['expanded'],
+            'wall_time': time.perf_counter() - t
+        })
+
+    return results
+
+
+def read_events(file_path):
+    """
+    Reads an obstacle event file. Every line is 'block x y [w h]' or 'clear x y [w h]' to change a rectangle of
+    cells, or 'move x y' to move the agent
+    :param file_path: Path to the event file
+    :return: A list of (action, x, y, w, h) tuples
+    """
+
+    events = []
+    with open(file_path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            action, values = line.split()[0], list(map(int, line.split()[1:]))
+            if action not in ('block', 'clear', 'move') or len(values) not in (2, 4):
+                raise Exception('Invalid event: %s' % line.strip())
+            events.append(tuple([action] + values + [1, 1][len(values) - 2:]))
+
+    return events
+
+
+def run_events(file_path, events, heuristic=ASTAR_HEURISTIC[0], compact=False, tie_break='fifo',
+               time_limit=TIMEOUT_THRESHOLD):
+    """
+    Plans a path on a board with D* Lite, then applies obstacle and move events one at a time,
+    repairing the plan after each of them instead of searching from scratch
+    :param file_path: Path to the board file
+    :param events: A list of (action, x, y, w, h) tuples, see read_events
+    :return: A dictionary with the outcome of the first plan and of every repair
+    """
+
+    problem = load_problem(file_path, problem_type='board', heuristic=heuristic, compact=compact)
+    solver = create_search(problem, mode='dstar', tie_break=tie_break)
+    plans = []
+
+    for event in [None] + events:
+        if event is not None:
+            action, x, y, w, h = event
+            if action == 'move':
+                solver.move_to(problem.get_node(x, y))
+                changed = []
+            else:
+                changed = [
+                    problem.set_walkable(cx, cy, action == 'clear')
+                    for cy in range(y, min(y + h, problem.height)) for cx in range(x, min(x + w, problem.width))
+                ]
+            solver.update(changed)
+
+        expanded = solver.stats['expanded']
+        t = time.perf_counter()
+        status, path = run_search(solver, t, time_limit)
+        plans.append({
+            'event': ' '.join(map(str, event)) if event else None,
+            'status': status,
+            'path_length': len(path) - 1 if status == 'solved' else None,
+            'expansions': solver.stats['expanded'] - expanded,
+            'wall_time': time.perf_counter() - t
+        })
+
+    return {
+        'file': file_path,
+        'heuristic': heuristic,
+        'compact': compact,
+        'search_stats': dict(solver.stats),
+        'plans': plans
+    }
+
+
+# The board loaded by a batch worker process, shared by every chunk of queries it solves
+_batch_problem = None
+
+
+def _init_batch_worker(file_path, heuristic, compact):
+    """
+    Loads the board once in a batch worker process
+    """
+
+    global _batch_problem
+    logging.disable(logging.CRITICAL)
+    _batch_problem = load_problem(file_path, problem_type='board', heuristic=heuristic, compact=compact)
+
+
+def _solve_batch_chunk(args):
+    """
+    Solves a chunk of queries on the board of the worker process
+    """
+
+    queries, options = args
+    return solve_queries(_batch_problem, queries, **options)
+
+
+def run_batch(file_path, queries, mode=ASTAR_OPTIONS[0], heuristic=ASTAR_HEURISTIC[0], compact=False,
+              tie_break='fifo', low_memory=False, weight=1.0, time_limit=TIMEOUT_THRESHOLD, processes=1):
+    """
+    Loads a board once and solves a batch of start and goal pairs on it, optionally spread over a process pool
+    where every worker loads the board once
+    :param file_path: Path to the board file
+    :param queries: A list of ((sx, sy), (gx, gy)) tuples
+    :param processes: Number of worker processes, 1 to solve the queries in this process
+    :return: A dictionary with the outcome of every query and the aggregate throughput
+    """
+
+    options = {
+        'mode': mode,
+        'tie_break': tie_break,
+        'low_memory': low_memory,
+        'weight': weight,
+        'time_limit': time_limit
+    }
+
+    t = time.perf_counter()
+    if processes > 1:
+        chunk_size = max(1, len(queries) // (processes * 4))
+        chunks = [(queries[i:i + chunk_size], options) for i in range(0, len(queries), chunk_size)]
+        with multiprocessing.Pool(processes, _init_batch_worker, (file_path, heuristic, compact)) as pool:
+            results = [result for chunk in pool.map(_solve_batch_chunk, chunks) for result in chunk]
+        load_time = None
+    else:
+        problem = load_problem(file_path, problem_type='board', heuristic=heuristic, compact=compact)
+        load_time = time.perf_counter() - t
+        results = solve_queries(problem, queries, **options)
+    total_time = time.perf_counter() - t
+
+    solved = [result for result in results if result['status'] == 'solved']
+    return {
+        'file': file_path,
+        'mode': mode,
+        'heuristic': heuristic,
+        'compact': compact,
+        'processes': processes,
+        'queries': len(results),
+        'solved': len(solved),
+        'expansions': sum(result['expansions'] for result in results),
+        'load_time': load_time,
+        'total_time': total_time,
+        'throughput': len(results) / total_time if total_time else None,
+        'results': results
+    }
+
+
+def main(argv=None):
+    """
+    Command line entry point. Solves every given file and prints one JSON object per file
+    """
+
+    parser = argparse.ArgumentParser(description='Solves boards, graphs and nonograms without the GUI')
+    parser.add_argument('files', nargs='+', help='Board, graph or nonogram files to solve')
+    parser.add_argument('--type', choices=sorted(PROBLEM_TYPES.values()), default=None,
+                        help='Problem type, detected from the directory name if omitted')
+    parser.add_argument('--mode', choices=ASTAR_OPTIONS, default=ASTAR_OPTIONS[0])
+    parser.add_argument('--heuristic', choices=ASTAR_HEURISTIC, default=ASTAR_HEURISTIC[0])
+    parser.add_argument('-k', type=int, default=GAC_DEFAULT_K, help='Number of colors for graphs')
+    parser.add_argument('--constraint', default=GAC_DEFAULT_CONSTRAINT, help='Constraint formula for graphs')
+    parser.add_argument('--engine', choices=sorted(GAC_ENGINES), default=GAC_DEFAULT_ENGINE,
+                        help='Propagation engine for graphs and nonograms')
+    parser.add_argument('--compact', action='store_true', help='Use the array backed grid engine for boards')
+    parser.add_argument('--tie-break', choices=['fifo', 'lifo'], default='fifo',
+                        help='Which of the nodes with equal F and H values to expand first')
+    parser.add_argument('--low-memory', action='store_true',
+                        help='Skip child bookkeeping and keep parents on the nodes, for consistent heuristics')
+    parser.add_argument('--weight', type=float, default=1.0,
+                        help='Weight on the heuristic, or the initial weight of the ara mode')
+    parser.add_argument('--time-limit', type=float, default=TIMEOUT_THRESHOLD, help='Seconds per search')
+    parser.add_argument('--queries', default=None,
+                        help='File with one \'sx sy gx gy\' pair per line, to solve on every given board')
+    parser.add_argument('--processes', type=int, default=1, help='Worker processes for --queries')
+    parser.add_argument('--events', default=None,
+                        help='File with block, clear and move events to replan with D* Lite on every given board')
+    parser.add_argument('--no-memory', action='store_true', help='Do not trace memory, for cleaner timings')
+    parser.add_argument('--indent', type=int, default=None, help='Pretty print the JSON output')
+    parser.add_argument('--verbose', action='store_true', help='Log to stderr')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(stream=sys.stderr, level=logging.DEBUG if args.verbose else logging.WARNING)
+
+    try:
+        check_search_options('dstar' if args.events else args.mode, low_memory=args.low_memory, weight=args.weight)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.events:
+        events = read_events(args.events)
+        for file_path in args.files:
+            result = run_events(
+                file_path,
+                events,
+                heuristic=args.heuristic,
+                compact=args.compact,
+                tie_break=args.tie_break,
+                time_limit=args.time_limit
+            )
+            print(json.dumps(result, indent=args.indent))
+        return
+
+    if args.queries:
+        queries = read_queries(args.queries)
+        for file_path in args.files:
+            result = run_batch(
+                file_path,
+                queries,
+                mode=args.mode,
+                heuristic=args.heuristic,
+                compact=args.compact,
+                tie_break=args.tie_break,
+                low_memory=args.low_memory,
+                weight=args.weight,
+                time_limit=args.time_limit,
+                processes=args.processes
+            )
+            print(json.dumps(result, indent=args.indent))
+        return
+
+    for file_path in args.files:
+        result = run_file(
+            file_path,
+            problem_type=args.type,
+            mode=args.mode,
+            heuristic=args.heuristic,
+            k=args.k,
+            constraint=args.constraint,
+            compact=args.compact,
+            tie_break=args.tie_break,
+            low_memory=args.low_memory,
+            weight=args.weight,
+            time_limit=args.time_limit,
+            trace_memory=not args.no_memory,
+            engine=args.engine
+        )
+        print(json.dumps(result, indent=args.indent))
+
+
+if __name__ == '__main__':
+    main()